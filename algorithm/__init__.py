@@ -1,3 +1,4 @@
 from packages.face_recognition.algorithm.config import FaceRecognitionConfig, FaceRecognitionConfigUI
-from packages.face_recognition.algorithm.function import FaceRecognitionFunction, FaceRecognitionInput, FaceResult
+from packages.face_recognition.algorithm.function import FaceRecognitionFunction, FaceRecognitionInput, FaceResult, close_functions
 from packages.face_recognition.algorithm.pipe import FaceRecognitionPipe
+from packages.face_recognition.algorithm.offline import OfflineRecognizer
@@ -0,0 +1,69 @@
+from __future__ import annotations
+import math
+import cv2
+import numpy as np
+
+# Size of the grey thumbnail compared by the motion gate
+MOTION_SIZE: tuple[int, int] = (64, 36)
+
+def det_sizes(det_size: tuple[int, int], min_det_size: int = 320) -> list[tuple[int, int]]:
+    # The detector takes any multiple of 32, keep the aspect ratio of det_size
+    width, height = det_size
+    return [
+        (size, max(32, round(height * size / width / 32) * 32))
+        for size in range(width // 32 * 32, max(32, min(min_det_size, width)) - 1, -32)
+    ] or [(width, height)]
+
+class AdaptiveController:
+    def __init__(self, det_size: tuple[int, int], target_latency: float, min_det_size: int = 320, motion_threshold: float = 0.0, max_skip: int = 30, alpha: float = 0.2, cooldown: int = 10) -> None:
+        self.sizes: list[tuple[int, int]] = det_sizes(det_size, min_det_size)
+        self.target_latency: float = target_latency
+        self.motion_threshold: float = motion_threshold
+        self.max_skip: int = max_skip
+        self.alpha: float = alpha
+        self.cooldown: int = cooldown
+        self.level: int = 0
+        self.latency: float = 0.0
+        self.since_change: int = 0
+        self.pending: int = 0
+        self.skipped: int = 0
+        self.reference: np.ndarray | None = None
+        self.thumbnail: np.ndarray | None = None
+
+    @property
+    def det_size(self) -> tuple[int, int]:
+        return self.sizes[self.level]
+
+    def moved(self, frame: np.ndarray) -> bool:
+        self.thumbnail = cv2.cvtColor(cv2.resize(frame, MOTION_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY).astype(np.int16)
+        # Compared with the last processed frame, so slow changes still add up
+        return self.reference is None or float(np.mean(np.abs(self.thumbnail - self.reference))) >= self.motion_threshold
+
+    def skip(self, frame: np.ndarray) -> bool:
+        if self.skipped >= self.max_skip:
+            if self.motion_threshold > 0:
+                self.moved(frame)
+            return False
+        if self.pending > 0:
+            self.pending -= 1
+        elif self.motion_threshold <= 0 or self.moved(frame):
+            return False
+        self.skipped += 1
+        return True
+
+    def observe(self, seconds: float) -> None:
+        self.latency = seconds if self.latency == 0 else self.alpha * seconds + (1 - self.alpha) * self.latency
+        self.skipped = 0
+        self.reference = self.thumbnail
+        self.since_change += 1
+        if self.since_change >= self.cooldown and not 0.6 * self.target_latency <= self.latency <= self.target_latency:
+            # Detection cost grows with the area, so aim the width at the square root of the latency ratio with some headroom
+            width: float = self.det_size[0] * math.sqrt(0.8 * self.target_latency / self.latency)
+            level: int = min(range(len(self.sizes)), key=lambda level: abs(self.sizes[level][0] - width))
+            if level != self.level:
+                self.level = level
+                self.since_change = 0
+                self.latency = 0.0
+        # At the smallest size, drop enough frames that the average frame stays within budget
+        over: bool = self.level == len(self.sizes) - 1 and self.latency > self.target_latency
+        self.pending = math.ceil(self.latency / self.target_latency) - 1 if over else 0
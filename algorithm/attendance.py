@@ -0,0 +1,31 @@
+from __future__ import annotations
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable
+
+class AttendanceTracker:
+    def __init__(self, interval: float) -> None:
+        self.interval: timedelta = timedelta(seconds=interval)
+        # Ordered by last sighting, so expired names are always at the front
+        self.latest: OrderedDict[str, datetime] = OrderedDict()
+
+    def expire(self, now: datetime) -> None:
+        while self.latest:
+            name, latest = next(iter(self.latest.items()))
+            if now - latest <= self.interval:
+                break
+            del self.latest[name]
+
+    def update(self, now: datetime, names: Iterable[str]) -> list[str]:
+        self.expire(now)
+        arrived: list[str] = []
+        for name in names:
+            if name not in self.latest:
+                arrived.append(name)
+            else:
+                self.latest.move_to_end(name)
+            self.latest[name] = now
+        return arrived
+
+    def __len__(self) -> int:
+        return len(self.latest)
@@ -5,6 +5,7 @@ from src.pipe import Pipe, Config, ConfigUI
 from src.ui.pipe.tile import PipeTile
 from typing import Any, Callable, NamedTuple, TYPE_CHECKING
 from packages.face_recognition.data import FaceRecognitionDataOutput
+from packages.face_recognition.model import MODULES, PROVIDERS
 if TYPE_CHECKING:
     from src.manager import Manager
     from src.ui.common import ConfigPage
@@ -27,11 +28,47 @@ class FaceRecognitionConfig(Config):
     ctx_id: int = 0
     det_thresh: float = 0.5
     det_size: tuple[int, int] = (640, 640)
+    providers: tuple[str, ...] = PROVIDERS
+    modules: tuple[str, ...] = MODULES
     threshold: float = 1.0
     unknown: str = "Unknown"
     attendance_interval: int = 300
     annotate: bool = True
     annotations: AnnotationConfig = AnnotationConfig()
+    index_backend: str = "auto"
+    exact_max_size: int = 10000
+    space: str = "Euclidean"
+    M: int = 12
+    ef_construction: int = 200
+    query_ef: int = 0
+    top_k: int = 1
+    tracking: bool = False
+    track_iou: float = 0.3
+    track_max_misses: int = 5
+    reembed_interval: int = 10
+    reembed_iou: float = 0.5
+    async_output: bool = False
+    output_queue_size: int = 8
+    frame_policy: str = "drop_oldest"
+    results_policy: str = "block"
+    attendance_policy: str = "block"
+    batching: bool = False
+    max_batch: int = 8
+    batch_latency: int = 10
+    metrics: bool = False
+    metrics_window: int = 1024
+    metrics_output: Pipe | None = None
+    metrics_interval: int = 60
+    watch: bool = False
+    watch_interval: int = 10
+    results_batch_size: int = 1
+    results_flush_interval: float = 1.0
+    results_format: str = "ndjson"
+    adaptive: bool = False
+    target_latency: int = 100
+    min_det_size: int = 320
+    motion_threshold: float = 0.0
+    max_skip: int = 30
 
 class FaceRecognitionConfigUI(ConfigUI):
     def __init__(self, instance: FaceRecognitionPipe, manager: Manager, config_page: ConfigPage) -> None:
@@ -90,6 +127,107 @@ class FaceRecognitionConfigUI(ConfigUI):
             ft.TextField(str(self.instance.config.annotations.text_scale), label="Text Scale", border_color="grey", input_filter=ft.InputFilter(allow=True, regex_string=r"[0-9\.]", replacement_string="")),
             ft.TextField(str(self.instance.config.annotations.text_thickness), label="Text Thickness", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
             ft.TextField(str(self.instance.config.annotations.padding), label="Padding", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.Container(
+                ft.Text("Index Configuration"),
+                padding=ft.padding.symmetric(vertical=20),
+            ),
+            ft.Dropdown(
+                self.instance.config.index_backend,
+                label="Search Backend",
+                options=[ft.dropdown.Option("auto"), ft.dropdown.Option("exact"), ft.dropdown.Option("voyager")],
+                border_color="grey",
+                dense=True,
+            ),
+            ft.TextField(str(self.instance.config.exact_max_size), label="Largest Gallery for Exact Search (auto)", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.Dropdown(
+                self.instance.config.space,
+                label="Distance",
+                options=[ft.dropdown.Option("Euclidean"), ft.dropdown.Option("Cosine"), ft.dropdown.Option("InnerProduct")],
+                border_color="grey",
+                dense=True,
+            ),
+            ft.TextField(str(self.instance.config.M), label="HNSW M", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.ef_construction), label="HNSW ef (construction)", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.query_ef), label="HNSW ef (query, 0 for default)", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.top_k), label="Neighbours to Vote", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.Container(
+                ft.Text("Tracking Configuration"),
+                padding=ft.padding.symmetric(vertical=20),
+            ),
+            ft.Switch(label="Track Faces across Frames", value=self.instance.config.tracking),
+            ft.TextField(str(self.instance.config.track_iou), label="Minimum Overlap to Track", border_color="grey", input_filter=ft.InputFilter(allow=True, regex_string=r"[0-9\.]", replacement_string="")),
+            ft.TextField(str(self.instance.config.track_max_misses), label="Frames to Keep Lost Tracks", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.reembed_interval), label="Frames between Re-recognition", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.reembed_iou), label="Re-recognize below Overlap", border_color="grey", input_filter=ft.InputFilter(allow=True, regex_string=r"[0-9\.]", replacement_string="")),
+            ft.Container(
+                ft.Text("Output Configuration"),
+                padding=ft.padding.symmetric(vertical=20),
+            ),
+            ft.Switch(label="Encode and Send Outputs in the Background", value=self.instance.config.async_output),
+            ft.TextField(str(self.instance.config.output_queue_size), label="Output Queue Size", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            *[
+                ft.Dropdown(
+                    policy,
+                    label=f"{label} Queue when Full",
+                    options=[ft.dropdown.Option("drop_oldest"), ft.dropdown.Option("block")],
+                    border_color="grey",
+                    dense=True,
+                )
+                for label, policy in (
+                    ("Frame", self.instance.config.frame_policy),
+                    ("Results", self.instance.config.results_policy),
+                    ("Attendance", self.instance.config.attendance_policy),
+                )
+            ],
+            ft.Container(
+                ft.Text("Batching Configuration"),
+                padding=ft.padding.symmetric(vertical=20),
+            ),
+            ft.Switch(label="Batch Frames with other Cameras", value=self.instance.config.batching),
+            ft.TextField(str(self.instance.config.max_batch), label="Frames per Batch", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.batch_latency), label="Batch Deadline (ms)", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.Container(
+                ft.Text("Metrics Configuration"),
+                padding=ft.padding.symmetric(vertical=20),
+            ),
+            ft.Switch(label="Record Stage Latencies", value=self.instance.config.metrics),
+            PipeTile(
+                "Metrics",
+                self.manager,
+                self.config_page,
+                self.select_pipe,
+                self.delete_pipe(44),
+                self.instance.config.metrics_output,
+            ),
+            ft.TextField(str(self.instance.config.metrics_interval), label="Seconds between Metrics Records", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.Container(
+                ft.Text("Live Updates"),
+                padding=ft.padding.symmetric(vertical=20),
+            ),
+            ft.Switch(label="Watch Database Path for Changes", value=self.instance.config.watch),
+            ft.TextField(str(self.instance.config.watch_interval), label="Seconds between Database Scans", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.Container(
+                ft.Text("Results"),
+                padding=ft.padding.symmetric(vertical=20),
+            ),
+            ft.TextField(str(self.instance.config.results_batch_size), label="Frames per Results Write", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.results_flush_interval), label="Seconds before Writing a Partial Batch", border_color="grey", input_filter=ft.InputFilter(allow=True, regex_string=r"[0-9\.]", replacement_string="")),
+            ft.Dropdown(
+                self.instance.config.results_format,
+                label="Results Format",
+                options=[ft.dropdown.Option("ndjson"), ft.dropdown.Option("binary")],
+                border_color="grey",
+                dense=True,
+            ),
+            ft.Container(
+                ft.Text("Latency Budget"),
+                padding=ft.padding.symmetric(vertical=20),
+            ),
+            ft.Switch(label="Adapt to Latency Budget", value=self.instance.config.adaptive),
+            ft.TextField(str(self.instance.config.target_latency), label="Target Latency per Frame (ms, 1000 / fps)", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.min_det_size), label="Minimum Detection Width", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.motion_threshold), label="Motion Threshold (0 to process still frames)", border_color="grey", input_filter=ft.InputFilter(allow=True, regex_string=r"[0-9\.]", replacement_string="")),
+            ft.TextField(str(self.instance.config.max_skip), label="Maximum Skipped Frames in a Row", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
         ])
 
     def refresh_data_options(self, update: bool = True):
@@ -130,4 +268,37 @@ class FaceRecognitionConfigUI(ConfigUI):
                 text_thickness=int(self.content.controls[16].value),
                 padding=int(self.content.controls[17].value),
             ),
+            index_backend=self.content.controls[19].value,
+            exact_max_size=int(self.content.controls[20].value),
+            space=self.content.controls[21].value,
+            M=int(self.content.controls[22].value),
+            ef_construction=int(self.content.controls[23].value),
+            query_ef=int(self.content.controls[24].value),
+            top_k=max(1, int(self.content.controls[25].value)),
+            tracking=self.content.controls[27].value,
+            track_iou=float(self.content.controls[28].value),
+            track_max_misses=int(self.content.controls[29].value),
+            reembed_interval=max(1, int(self.content.controls[30].value)),
+            reembed_iou=float(self.content.controls[31].value),
+            async_output=self.content.controls[33].value,
+            output_queue_size=max(1, int(self.content.controls[34].value)),
+            frame_policy=self.content.controls[35].value,
+            results_policy=self.content.controls[36].value,
+            attendance_policy=self.content.controls[37].value,
+            batching=self.content.controls[39].value,
+            max_batch=max(1, int(self.content.controls[40].value)),
+            batch_latency=int(self.content.controls[41].value),
+            metrics=self.content.controls[43].value,
+            metrics_output=self.content.controls[44].instance,
+            metrics_interval=int(self.content.controls[45].value),
+            watch=self.content.controls[47].value,
+            watch_interval=max(1, int(self.content.controls[48].value)),
+            results_batch_size=max(1, int(self.content.controls[50].value)),
+            results_flush_interval=float(self.content.controls[51].value),
+            results_format=self.content.controls[52].value,
+            adaptive=self.content.controls[54].value,
+            target_latency=max(1, int(self.content.controls[55].value)),
+            min_det_size=max(32, int(self.content.controls[56].value)),
+            motion_threshold=float(self.content.controls[57].value),
+            max_skip=int(self.content.controls[58].value),
         )
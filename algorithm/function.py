@@ -1,12 +1,27 @@
 from __future__ import annotations
-from datetime import datetime, timedelta
+from datetime import datetime
+import io
 import json
-from typing import NamedTuple
+import threading
+import time
+import weakref
+from typing import Callable, NamedTuple
 import cv2
 from insightface.app import FaceAnalysis
 import numpy as np
 import voyager
+import packages.face_recognition.model as model
 from packages.face_recognition.algorithm import FaceRecognitionConfig
+from packages.face_recognition.algorithm.adaptive import AdaptiveController
+from packages.face_recognition.algorithm.attendance import AttendanceTracker
+from packages.face_recognition.algorithm.index import ExactIndex, rescore
+from packages.face_recognition.algorithm.output import AsyncOutput, ResultsEmitter
+from packages.face_recognition.algorithm.scheduler import BatchScheduler, get_scheduler
+from packages.face_recognition.algorithm.tracker import FaceTracker, Track
+from packages.face_recognition.algorithm.watcher import GalleryWatcher
+from packages.face_recognition.data.names import NameTable
+from packages.face_recognition.data.store import build_index, dequantize, get_embeddings, get_index, release_index
+from packages.face_recognition.metrics import Metrics, NullMetrics
 from src.pipe.function import IO, Function
 
 class FaceRecognitionInput(IO):
@@ -21,86 +36,299 @@ class FaceResult(NamedTuple):
 class BytesOutput(IO):
     data: bytes # = b""
 
+# Functions are built by upstream pipes, so the pipe finds its own by config when it stops
+_functions: weakref.WeakSet[FaceRecognitionFunction] = weakref.WeakSet()
+_functions_lock: threading.Lock = threading.Lock()
+
+def close_functions(config: FaceRecognitionConfig) -> None:
+    with _functions_lock:
+        functions: list[FaceRecognitionFunction] = [function for function in _functions if function.config is config]
+    for function in functions:
+        function.close()
+
 class FaceRecognitionFunction(Function):
     cls_input: type[FaceRecognitionInput] = FaceRecognitionInput
 
-    def __init__(self, config: FaceRecognitionConfig) -> None:
+    def __init__(self, config: FaceRecognitionConfig, models: bool = True) -> None:
+        # Without models the function only emits results recognized elsewhere, see OfflineRecognizer
         self.config: FaceRecognitionConfig = config
-        self.app = FaceAnalysis(providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
-        self.app.prepare(ctx_id=self.config.ctx_id, det_thresh=self.config.det_thresh, det_size=self.config.det_size)
-        if self.config.data:
-            self.names: list[tuple[str, str]] = self.config.data.names
-            self.embeddings: voyager.Index = voyager.Index(voyager.Space.Euclidean, num_dimensions=512)
-            self.embeddings.add_items(self.config.data.embeddings)
-            self.no_data: bool = False
+        self.metrics: Metrics = Metrics(self.config.metrics_window) if self.config.metrics else NullMetrics()
+        self.app: FaceAnalysis | None = model.get_app(self.config.ctx_id, self.config.det_size, self.config.det_thresh, self.config.providers, self.config.modules) if models else None
+        self.scheduler: BatchScheduler | None = get_scheduler(self.app, self.config.max_batch, self.config.batch_latency / 1000) if models and self.config.batching else None
+        if self.scheduler:
+            self.metrics.gauge("scheduler_queue_depth", self.scheduler.queue.qsize)
+        self.gallery_lock: threading.Lock = threading.Lock()
+        self.update_lock: threading.Lock = threading.Lock()
+        # Held by frames and close(), so outputs are not swapped or closed under a frame
+        self.running: threading.RLock = threading.RLock()
+        space: voyager.Space = getattr(voyager.Space, self.config.space)
+        # Released on close, so the index is dropped once no pipe uses it
+        self.shared_index: voyager.Index | None = None
+        if self.config.data and models:
+            self.names: list[tuple[str, str]] | NameTable = self.config.data.names
+            if self.config.index_backend == "exact" or (self.config.index_backend == "auto" and len(self.names) <= self.config.exact_max_size):
+                self.embeddings: voyager.Index | ExactIndex = ExactIndex(get_embeddings(self.config.data), space)
+            else:
+                self.embeddings: voyager.Index | ExactIndex = get_index(self.config.data, space, self.config.M, self.config.ef_construction)
+                self.shared_index = self.embeddings
         else:
-            self.no_data: bool = True
-        self.latest: dict[str, datetime] = {}
+            self.names: list[tuple[str, str]] | NameTable = []
+            self.embeddings: voyager.Index | ExactIndex = ExactIndex(np.empty((0, model.EMBEDDING_SIZE), dtype=np.float32), space) if self.config.index_backend != "voyager" or not models else build_index(np.empty((0, model.EMBEDDING_SIZE)), space, self.config.M, self.config.ef_construction)
+        # Attendance is only recorded against a gallery
+        self.no_data: bool = not self.config.data
+        # Names and the Voyager index may be shared with other pipes until the first live update
+        self.shared: bool = True
+        # Labels of entries marked deleted in the index
+        self.deleted: set[int] = set()
+        self.live: int = len(self.names)
+        self.tracker: FaceTracker | None = FaceTracker(self.config.track_iou, self.config.track_max_misses) if self.config.tracking else None
+        self.adaptive: AdaptiveController | None = None
+        if self.config.adaptive:
+            self.adaptive = AdaptiveController(self.config.det_size, self.config.target_latency / 1000, self.config.min_det_size, self.config.motion_threshold, self.config.max_skip)
+            self.metrics.gauge("det_width", lambda: self.adaptive.det_size[0])
+        # Carried over to frames the adaptive controller skips
+        self.previous: list[FaceResult] = []
+        self.attendance: AttendanceTracker = AttendanceTracker(self.config.attendance_interval)
+        self.results: ResultsEmitter = ResultsEmitter(self.write_results, self.config.results_batch_size, self.config.results_flush_interval, self.config.results_format)
         self.frame_output = self.config.frame_output.cls_function(self.config.frame_output.config) if self.config.frame_output else None
         self.results_output = self.config.results_output.cls_function(self.config.results_output.config) if self.config.results_output else None
         self.attendance_output = self.config.attendance_output.cls_function(self.config.attendance_output.config) if self.config.attendance_output else None
-
-    def __call__(self, input: FaceRecognitionInput) -> IO:
-        faces = self.app.get(input.frame)
-        res: list[FaceResult] = []
-        if self.no_data:
-            for face in faces:
-                res.append(FaceResult(
-                    name=self.config.unknown,
-                    image="",
-                    distance=0.0,
-                    box=list(map(int, face.bbox)),
-                ))
+        if self.config.async_output:
+            self.emit_frame: Callable[[np.ndarray, list[FaceResult]], None] = AsyncOutput(self.output_frame, self.config.output_queue_size, self.config.frame_policy)
+            self.emit_results: Callable[[datetime, list[FaceResult]], None] = AsyncOutput(self.output_results, self.config.output_queue_size, self.config.results_policy)
+            self.emit_attendance: Callable[[datetime, list[FaceResult]], None] = AsyncOutput(self.output_attendance, self.config.output_queue_size, self.config.attendance_policy)
+            for name, output in (("frame", self.emit_frame), ("results", self.emit_results), ("attendance", self.emit_attendance)):
+                self.metrics.gauge(f"{name}_queue_depth", output.queue.qsize)
+                self.metrics.gauge(f"{name}_dropped", lambda output=output: output.dropped)
         else:
-            for face in faces:
-                neighbors, distances = self.embeddings.query(face.normed_embedding, k=1)
+            self.emit_frame: Callable[[np.ndarray, list[FaceResult]], None] = self.output_frame
+            self.emit_results: Callable[[datetime, list[FaceResult]], None] = self.output_results
+            self.emit_attendance: Callable[[datetime, list[FaceResult]], None] = self.output_attendance
+        self.metrics_output = self.config.metrics_output.cls_function(self.config.metrics_output.config) if self.config.metrics_output else None
+        self.metrics_due: float = time.monotonic() + self.config.metrics_interval
+        self.watcher: GalleryWatcher | None = None
+        if self.config.watch and self.config.data and self.config.data.source:
+            self.watcher = GalleryWatcher(self, self.config.data.source, self.config.watch_interval)
+        with _functions_lock:
+            _functions.add(self)
+
+    def vote(self, neighbors: np.ndarray, distances: np.ndarray) -> tuple[int, float]:
+        if len(neighbors) == 1 or distances[0] >= self.config.threshold:
+            return int(neighbors[0]), float(distances[0])
+        # neighbors are sorted by distance, so the first hit of a name is its closest image
+        votes: dict[str, list] = {}
+        for neighbor, distance in zip(neighbors, distances):
+            if distance >= self.config.threshold:
+                break
+            name: str = self.names[neighbor][0]
+            if name in votes:
+                votes[name][0] += 1
+            else:
+                votes[name] = [1, int(neighbor), float(distance)]
+        _, neighbor, distance = max(votes.values(), key=lambda vote: (vote[0], -vote[2]))
+        return neighbor, distance
+
+    def lookup(self, embeddings: np.ndarray, boxes: np.ndarray) -> list[FaceResult]:
+        with self.gallery_lock:
+            if self.no_data or not self.live or not len(embeddings):
+                return [FaceResult(name=self.config.unknown, image="", distance=0.0, box=list(map(int, box))) for box in boxes]
+            res: list[FaceResult] = []
+            with self.metrics.time("query"):
+                neighbors, distances = self.embeddings.query(
+                    embeddings,
+                    k=max(1, min(self.config.top_k, self.live)),
+                    query_ef=self.config.query_ef or -1,
+                )
+                if isinstance(self.embeddings, voyager.Index) and self.embeddings.storage_data_type != voyager.StorageDataType.Float32:
+                    neighbors, distances = rescore(self.embeddings, embeddings, neighbors)
+            for box, face_neighbors, face_distances in zip(boxes, neighbors, distances):
+                neighbor, distance = self.vote(face_neighbors, face_distances)
                 res.append(FaceResult(
-                    name=self.names[neighbors[0]][0] if distances[0] < self.config.threshold else self.config.unknown,
-                    image=self.names[neighbors[0]][1],
-                    distance=float(distances[0]),
-                    box=list(map(int, face.bbox)),
+                    name=self.names[neighbor][0] if distance < self.config.threshold else self.config.unknown,
+                    image=self.names[neighbor][1],
+                    distance=float(distance),
+                    box=list(map(int, box)),
                 ))
-        if self.frame_output:
-            if self.config.annotate:
-                padding = self.config.annotations.padding
-                half_padding = padding // 2
-                for face in res:
-                    face_box = face.box
-                    (text_width, text_height) = cv2.getTextSize(face.name, self.config.annotations.font, self.config.annotations.text_scale, self.config.annotations.text_thickness)[0]
-                    cv2.rectangle(input.frame, (face_box[0], face_box[1]), (face_box[2], face_box[3]), 
-                        self.config.annotations.known_box_color if face.name != self.config.unknown else self.config.annotations.unknown_box_color, self.config.annotations.box_thickness)
-                    cv2.rectangle(input.frame, (face_box[0], face_box[1] - padding - text_height), (face_box[0] + padding + text_width, face_box[1]), (255, 255, 255), cv2.FILLED)
-                    cv2.putText(input.frame, face.name, (face_box[0] + half_padding, face_box[1] - half_padding), self.config.annotations.font, self.config.annotations.text_scale, (0, 0, 0), self.config.annotations.text_thickness)
-
-            flag, enc = cv2.imencode('.jpg', input.frame)
-            if flag:
+            return res
+
+    def update_gallery(self, added: list[tuple[str, str]] | None = None, embeddings: np.ndarray | None = None, removed: list[tuple[str, str]] | None = None) -> None:
+        added, removed = added or [], removed or []
+        with self.update_lock:
+            # Only updates change names and the index, so everything up to the swap runs outside the gallery lock and frames keep flowing
+            names: list[tuple[str, str]] | NameTable = self.names.copy() if self.shared else self.names
+            index: voyager.Index | ExactIndex = self.embeddings
+            if self.shared and isinstance(index, voyager.Index):
+                index = voyager.Index.load(io.BytesIO(index.as_bytes()))
+            keys: set[tuple[str, str]] = {*removed, *added}
+            old: list[int] = names.indices(keys) if isinstance(names, NameTable) else [label for label, key in enumerate(names) if key in keys]
+            old = [label for label in old if label not in self.deleted]
+            with self.gallery_lock:
+                if self.shared:
+                    self.names = names
+                    self.embeddings = index
+                    self.shared = False
+                for label in old:
+                    self.embeddings.mark_deleted(label)
+                    self.deleted.add(label)
+                self.live -= len(old)
+                if added:
+                    self.embeddings.add_items(dequantize(np.asarray(embeddings)), ids=list(range(len(self.names), len(self.names) + len(added))))
+                    self.names.extend(added)
+                    self.live += len(added)
+                    self.no_data = False
+
+    def gallery_keys(self) -> set[tuple[str, str]]:
+        with self.update_lock:
+            return {key for label, key in enumerate(self.names) if label not in self.deleted}
+
+    def add_identity(self, name: str, embeddings: np.ndarray, images: list[str]) -> None:
+        self.update_gallery([(name, image) for image in images], embeddings)
+
+    def remove_identity(self, name: str) -> None:
+        with self.gallery_lock:
+            rows: list[int] | np.ndarray = self.names.rows(name) if isinstance(self.names, NameTable) else [label for label, key in enumerate(self.names) if key[0] == name]
+            removed: list[tuple[str, str]] = [self.names[label] for label in rows if label not in self.deleted]
+        self.update_gallery(removed=removed)
+
+    def detect(self, frame: np.ndarray, input_size: tuple[int, int] | None = None) -> tuple[np.ndarray, np.ndarray]:
+        # Read once, close() may clear it between frames
+        scheduler: BatchScheduler | None = self.scheduler
+        with self.metrics.time("detect"):
+            if scheduler:
+                return scheduler.detect(frame, input_size)
+            return model.detect(self.app, frame, input_size)
+
+    def embed(self, frame: np.ndarray, kpss: np.ndarray) -> np.ndarray:
+        scheduler: BatchScheduler | None = self.scheduler
+        with self.metrics.time("align"):
+            crops: list[np.ndarray] = model.align(self.app, frame, kpss)
+        with self.metrics.time("embed"):
+            if scheduler:
+                return scheduler.embed(crops)
+            return model.embed(self.app, crops)
+
+    def recognize(self, frame: np.ndarray, input_size: tuple[int, int] | None = None) -> list[FaceResult]:
+        bboxes, kpss = self.detect(frame, input_size)
+        boxes: np.ndarray = bboxes[:, :4]
+        if self.tracker is None:
+            return self.lookup(self.embed(frame, kpss), boxes)
+        tracks: list[Track] = self.tracker.update(boxes)
+        stale: list[int] = [
+            index for index, track in enumerate(tracks)
+            if track.result is None or track.age >= self.config.reembed_interval or track.iou < self.config.reembed_iou
+        ]
+        if stale:
+            for index, result in zip(stale, self.lookup(self.embed(frame, kpss[stale]), boxes[stale])):
+                tracks[index].result = result
+                tracks[index].age = 0
+        return [track.result._replace(box=list(map(int, box))) for track, box in zip(tracks, boxes)]
+
+    def annotate(self, frame: np.ndarray, res: list[FaceResult]) -> None:
+        padding = self.config.annotations.padding
+        half_padding = padding // 2
+        for face in res:
+            face_box = face.box
+            (text_width, text_height) = cv2.getTextSize(face.name, self.config.annotations.font, self.config.annotations.text_scale, self.config.annotations.text_thickness)[0]
+            cv2.rectangle(frame, (face_box[0], face_box[1]), (face_box[2], face_box[3]), 
+                self.config.annotations.known_box_color if face.name != self.config.unknown else self.config.annotations.unknown_box_color, self.config.annotations.box_thickness)
+            cv2.rectangle(frame, (face_box[0], face_box[1] - padding - text_height), (face_box[0] + padding + text_width, face_box[1]), (255, 255, 255), cv2.FILLED)
+            cv2.putText(frame, face.name, (face_box[0] + half_padding, face_box[1] - half_padding), self.config.annotations.font, self.config.annotations.text_scale, (0, 0, 0), self.config.annotations.text_thickness)
+
+    def output_frame(self, frame: np.ndarray, res: list[FaceResult]) -> None:
+        if self.config.annotate:
+            with self.metrics.time("annotate"):
+                self.annotate(frame, res)
+
+        with self.metrics.time("encode"):
+            flag, enc = cv2.imencode('.jpg', frame)
+        if flag:
+            with self.metrics.time("frame_output"):
                 self.frame_output(BytesOutput(
                     data=enc.tobytes(),
                 ))
-            # if flag:
-            #     self.channels["frame"].update((b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + enc.tobytes() + b'\r\n'))
-            # if self.config["frame"]["file"]:
-            #     self.videowriter.write(img)
+        # if flag:
+        #     self.channels["frame"].update((b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + enc.tobytes() + b'\r\n'))
+        # if self.config["frame"]["file"]:
+        #     self.videowriter.write(img)
 
-        if res:
-            if self.results_output:
-                self.results_output(BytesOutput(
-                    data=(json.dumps({str(datetime.now()): [face._asdict() for face in res]}) + "\n").encode("latin-1"),
+    def output_results(self, now: datetime, res: list[FaceResult]) -> None:
+        self.results(now, res)
+
+    def write_results(self, data: bytes) -> None:
+        with self.metrics.time("results_output"):
+            self.results_output(BytesOutput(
+                data=data,
+            ))
+
+    def output_attendance(self, now: datetime, res: list[FaceResult]) -> None:
+        names: list[str] = self.attendance.update(now, [face.name for face in res if face.name != self.config.unknown])
+        if names:
+            with self.metrics.time("attendance_output"):
+                self.attendance_output(BytesOutput(
+                    data=(json.dumps({str(now): names}) + "\n").encode("latin-1"),
                 ))
 
-            if not self.no_data and self.attendance_output:
-                names: list[str] = []
-                now: datetime = datetime.now()
-                for face in res:
-                    name: str = face.name
-                    if (name != self.config.unknown):
-                        if (name not in self.latest) or (now - self.latest[name] > timedelta(seconds=self.config.attendance_interval)):
-                            names.append(name)
-                        self.latest[name] = now
-
-                if names:
-                    # self.attendance_output("".join(f"{now},{name}\n" for name in names).encode("latin-1"))
-                    self.attendance_output(BytesOutput(
-                        data="".join(["{\"", str(now), "\": ",  str(names).replace("'", '"'), "}\n"]).encode("latin-1"),
-                    ))
-        return IO()
+    def stats(self) -> dict:
+        stats: dict = self.metrics.snapshot()
+        if stats:
+            stats["unknown_rate"] = stats["counters"].get("unknown", 0) / max(1, stats["counters"].get("faces", 0))
+        return stats
+
+    def close(self) -> None:
+        with self.running:
+            with _functions_lock:
+                _functions.discard(self)
+            if self.watcher:
+                self.watcher.close()
+                self.watcher = None
+            if self.scheduler:
+                self.scheduler.unregister()
+                self.scheduler = None
+            if self.shared_index is not None:
+                release_index(self.shared_index)
+                self.shared_index = None
+            for output in (self.emit_frame, self.emit_results, self.emit_attendance):
+                if isinstance(output, AsyncOutput):
+                    output.close()
+            # Stays usable, without background threads, if it is called again after the pipe stopped
+            self.emit_frame, self.emit_results, self.emit_attendance = self.output_frame, self.output_results, self.output_attendance
+            if self.results_output:
+                self.results.flush()
+
+    def __call__(self, input: FaceRecognitionInput) -> IO:
+        with self.running:
+            if self.adaptive is None:
+                with self.metrics.time("recognize"):
+                    res: list[FaceResult] = self.recognize(input.frame)
+                self.emit(input.frame, res, datetime.now())
+                return IO()
+            if self.adaptive.skip(input.frame):
+                self.metrics.count("skipped")
+                self.emit(input.frame, self.previous, datetime.now())
+                return IO()
+            start: float = time.perf_counter()
+            with self.metrics.time("recognize"):
+                self.previous = self.recognize(input.frame, self.adaptive.det_size)
+            self.emit(input.frame, self.previous, datetime.now())
+            self.adaptive.observe(time.perf_counter() - start)
+            return IO()
+
+    def emit(self, frame: np.ndarray, res: list[FaceResult], now: datetime) -> None:
+        with self.running:
+            if self.metrics.enabled:
+                self.metrics.count("frames")
+                self.metrics.count("faces", len(res))
+                self.metrics.count("unknown", sum(face.name == self.config.unknown for face in res))
+                self.metrics.observe("faces_per_frame", len(res))
+            if self.frame_output:
+                self.emit_frame(frame, res)
+            # Batched results also need empty frames, to flush on time
+            if self.results_output and (res or self.config.results_batch_size > 1):
+                self.emit_results(now, res)
+            if res and not self.no_data and self.attendance_output:
+                self.emit_attendance(now, res)
+            if self.metrics_output and time.monotonic() >= self.metrics_due:
+                self.metrics_due = time.monotonic() + self.config.metrics_interval
+                self.metrics_output(BytesOutput(
+                    data=(json.dumps({str(now): self.stats()}) + "\n").encode("latin-1"),
+                ))
@@ -0,0 +1,91 @@
+from __future__ import annotations
+import numpy as np
+import voyager
+from packages.face_recognition.data.store import CHUNK, dequantize, quantize, storage_of
+from packages.face_recognition.model import EMBEDDING_SIZE
+
+def square_norms(embeddings: np.ndarray) -> np.ndarray:
+    norms: np.ndarray = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), CHUNK):
+        chunk: np.ndarray = dequantize(embeddings[start:start + CHUNK])
+        norms[start:start + CHUNK] = np.einsum("ij,ij->i", chunk, chunk)
+    return norms
+
+def space_distances(space: voyager.Space, dots: np.ndarray, query_norms: np.ndarray, norms: np.ndarray) -> np.ndarray:
+    if space == voyager.Space.Euclidean:
+        # Squared L2, same as Voyager
+        return np.maximum(query_norms + norms - 2 * dots, 0)
+    if space == voyager.Space.Cosine:
+        return 1 - dots / np.maximum(np.sqrt(query_norms * norms), 1e-12)
+    return 1 - dots
+
+def rescore(index: voyager.Index, vectors: np.ndarray, neighbors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Voyager's 8-bit distances are approximations, recompute them from the stored vectors so they match ExactIndex
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_SIZE)
+    stored: np.ndarray = index.get_vectors(neighbors.reshape(-1).tolist()).reshape(*neighbors.shape, EMBEDDING_SIZE)
+    distances: np.ndarray = space_distances(
+        index.space,
+        np.einsum("ij,ikj->ik", vectors, stored),
+        np.einsum("ij,ij->i", vectors, vectors)[:, None],
+        np.einsum("ikj,ikj->ik", stored, stored),
+    )
+    order: np.ndarray = np.argsort(distances, axis=1)
+    return np.take_along_axis(neighbors, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+class ExactIndex:
+    def __init__(self, embeddings: np.ndarray, space: voyager.Space = voyager.Space.Euclidean) -> None:
+        self.space: voyager.Space = space
+        # float16 and int8 galleries stay quantized and are converted a chunk at a time per query
+        self.embeddings: np.ndarray = np.ascontiguousarray(quantize(embeddings, storage_of(np.asarray(embeddings))))
+        self.norms: np.ndarray = square_norms(self.embeddings)
+        self.deleted: np.ndarray = np.zeros(len(self.embeddings), dtype=bool)
+        self.any_deleted: bool = False
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    def add_items(self, vectors: np.ndarray, ids: list[int] | None = None) -> list[int]:
+        vectors = quantize(np.asarray(vectors, dtype=np.float32), storage_of(self.embeddings))
+        new_ids: list[int] = list(range(len(self), len(self) + len(vectors)))
+        if ids is not None and list(ids) != new_ids:
+            raise ValueError("ExactIndex only appends, ids must continue from the current size")
+        # Build new arrays instead of growing in place, they may be shared with the gallery
+        self.embeddings = np.concatenate([self.embeddings, vectors])
+        self.norms = np.concatenate([self.norms, square_norms(vectors)])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(vectors), dtype=bool)])
+        return new_ids
+
+    def mark_deleted(self, id: int) -> None:
+        self.deleted[id] = True
+        self.any_deleted = True
+
+    def dots(self, vectors: np.ndarray) -> np.ndarray:
+        if self.embeddings.dtype == np.float32:
+            return vectors @ self.embeddings.T
+        dots: np.ndarray = np.empty((len(vectors), len(self)), dtype=np.float32)
+        for start in range(0, len(self), CHUNK):
+            dots[:, start:start + CHUNK] = vectors @ dequantize(self.embeddings[start:start + CHUNK]).T
+        return dots
+
+    def distances(self, vectors: np.ndarray) -> np.ndarray:
+        distances: np.ndarray = space_distances(self.space, self.dots(vectors), np.einsum("ij,ij->i", vectors, vectors)[:, None], self.norms[None, :])
+        if self.any_deleted:
+            distances[:, self.deleted] = np.inf
+        return distances
+
+    def query(self, vectors: np.ndarray, k: int = 1, num_threads: int = -1, query_ef: int = -1) -> tuple[np.ndarray, np.ndarray]:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        single: bool = vectors.ndim == 1
+        vectors = vectors.reshape(-1, EMBEDDING_SIZE)
+        distances: np.ndarray = self.distances(vectors)
+        k = min(k, len(self))
+        if k < len(self):
+            neighbors: np.ndarray = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            neighbors = np.broadcast_to(np.arange(len(self)), distances.shape)
+        order: np.ndarray = np.argsort(np.take_along_axis(distances, neighbors, axis=1), axis=1)
+        neighbors = np.take_along_axis(neighbors, order, axis=1)
+        distances = np.take_along_axis(distances, neighbors, axis=1)
+        if single:
+            return neighbors[0], distances[0]
+        return neighbors, distances
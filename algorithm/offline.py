@@ -0,0 +1,164 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import copy
+from datetime import datetime, timedelta
+import multiprocessing
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+from tqdm import tqdm
+import packages.face_recognition.model as model
+from packages.face_recognition.algorithm import FaceRecognitionConfig
+from packages.face_recognition.algorithm.function import FaceRecognitionFunction, FaceResult
+from typing import Iterator, NamedTuple
+
+class OfflineFrame(NamedTuple):
+    index: int
+    timestamp: datetime
+    frame: np.ndarray
+
+_function: FaceRecognitionFunction | None = None
+
+def _init_worker(config: FaceRecognitionConfig, threads: int) -> None:
+    global _function
+    # Every worker's sessions would otherwise take a thread per core, the function picks up the app registered for its settings
+    model.register_app(model.get_app(config.ctx_id, config.det_size, config.det_thresh, config.providers, config.modules, threads), config.ctx_id, config.det_size, config.det_thresh, config.providers, config.modules)
+    _function = FaceRecognitionFunction(config)
+
+def _recognize(frame: np.ndarray) -> list[FaceResult]:
+    return _function.recognize(frame)
+
+class OfflineRecognizer:
+    def __init__(self, config: FaceRecognitionConfig, workers: int = min(4, os.cpu_count() or 1), threads: int | None = None, every: int = 1, prefetch: int = 16, context: str = "spawn") -> None:
+        self.config: FaceRecognitionConfig = config
+        self.workers: int = workers
+        # ONNX Runtime threads per worker, the cores split between the workers by default
+        self.threads: int = threads or max(1, (os.cpu_count() or 1) // max(1, workers))
+        self.every: int = max(1, every)
+        self.prefetch: int = max(1, prefetch)
+        self.context: str = context
+
+    def parent_config(self) -> FaceRecognitionConfig:
+        # With workers this process only emits, otherwise it recognizes frames in order and can still track
+        config: FaceRecognitionConfig = copy.copy(self.config)
+        config.batching = config.watch = config.adaptive = False
+        config.tracking = config.tracking and self.workers <= 0
+        return config
+
+    def worker_config(self) -> FaceRecognitionConfig:
+        # Workers only recognize, outputs and their state stay in this process
+        config: FaceRecognitionConfig = copy.copy(self.config)
+        config.frame_output = config.results_output = config.attendance_output = config.metrics_output = None
+        # Consecutive frames land on different workers, so there is nothing to track
+        config.tracking = config.async_output = config.batching = config.watch = config.adaptive = False
+        return config
+
+    def read(self, path: str, start: datetime | None = None) -> Iterator[OfflineFrame]:
+        if os.path.isdir(path):
+            filenames: list[str] = sorted(filename for filename in os.listdir(path) if filename.endswith(".png") or filename.endswith(".jpg"))
+            # Frames are stamped with their modification times, shifted so the first one is at start if given
+            first: datetime | None = datetime.fromtimestamp(os.path.getmtime(os.path.join(path, filenames[0]))) if filenames else None
+            for index, filename in enumerate(filenames[::self.every]):
+                frame: np.ndarray | None = cv2.imread(os.path.join(path, filename))
+                if frame is not None:
+                    timestamp: datetime = datetime.fromtimestamp(os.path.getmtime(os.path.join(path, filename)))
+                    yield OfflineFrame(index * self.every, timestamp if start is None else start + (timestamp - first), frame)
+            return
+        capture: cv2.VideoCapture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise Exception(f"{path} could not be opened")
+        try:
+            fps: float = capture.get(cv2.CAP_PROP_FPS)
+            if start is None:
+                # Files are written as they are recorded, so the recording ends around the modification time
+                start = datetime.fromtimestamp(os.path.getmtime(path)) - timedelta(seconds=capture.get(cv2.CAP_PROP_FRAME_COUNT) / fps if fps > 0 else 0)
+            index: int = 0
+            # grab() skips a frame without decoding it
+            while capture.grab():
+                if index % self.every == 0:
+                    flag, frame = capture.retrieve()
+                    if flag:
+                        yield OfflineFrame(index, start + timedelta(milliseconds=capture.get(cv2.CAP_PROP_POS_MSEC)), frame)
+                index += 1
+        finally:
+            capture.release()
+
+    def frames(self, path: str, start: datetime | None = None) -> Iterator[OfflineFrame]:
+        frames: queue.Queue[OfflineFrame | Exception | None] = queue.Queue(self.prefetch)
+        stopped: threading.Event = threading.Event()
+
+        def put(item: OfflineFrame | Exception | None) -> bool:
+            # Gives up once the consumer has stopped, it no longer drains the queue
+            while not stopped.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def decode() -> None:
+            try:
+                for frame in self.read(path, start):
+                    if not put(frame):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+
+        thread: threading.Thread = threading.Thread(target=decode, daemon=True)
+        thread.start()
+        try:
+            while (frame := frames.get()) is not None:
+                if isinstance(frame, Exception):
+                    raise frame
+                yield frame
+        finally:
+            stopped.set()
+            thread.join()
+
+    def total(self, path: str) -> int | None:
+        if os.path.isdir(path):
+            return None
+        capture: cv2.VideoCapture = cv2.VideoCapture(path)
+        count: int = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        return -(-count // self.every) if count > 0 else None
+
+    def __call__(self, path: str, start: datetime | None = None, progress: bool = True) -> int:
+        function: FaceRecognitionFunction = FaceRecognitionFunction(self.parent_config(), models=self.workers <= 0)
+        executor: ProcessPoolExecutor | None = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context(self.context),
+            initializer=_init_worker,
+            initargs=(self.worker_config(), self.threads),
+        ) if self.workers > 0 else None
+        # Futures in frame order, so results are emitted in order however the workers finish
+        pending: deque[tuple[OfflineFrame, Future]] = deque()
+        count: int = 0
+
+        def emit() -> None:
+            frame, future = pending.popleft()
+            function.emit(frame.frame, future.result(), frame.timestamp)
+            bar.update()
+
+        try:
+            with tqdm(total=self.total(path), disable=not progress, unit="frame") as bar:
+                for frame in self.frames(path, start):
+                    if executor is None:
+                        function.emit(frame.frame, function.recognize(frame.frame), frame.timestamp)
+                        bar.update()
+                    else:
+                        pending.append((frame, executor.submit(_recognize, frame.frame)))
+                        if len(pending) >= 2 * self.workers:
+                            emit()
+                    count += 1
+                while pending:
+                    emit()
+        finally:
+            if executor: executor.shutdown(cancel_futures=True)
+            function.close()
+        return count
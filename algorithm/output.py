@@ -0,0 +1,109 @@
+from __future__ import annotations
+from datetime import datetime
+import json
+import queue
+import struct
+import threading
+import time
+import traceback
+from typing import Any, Callable, TYPE_CHECKING
+if TYPE_CHECKING:
+    from packages.face_recognition.algorithm import FaceResult
+
+# Binary record: frame timestamp (Unix seconds) and face count, then per face name and image lengths, distance and box, then both strings in UTF-8
+FRAME_RECORD: struct.Struct = struct.Struct("<dH")
+FACE_RECORD: struct.Struct = struct.Struct("<HHf4i")
+
+class AsyncOutput:
+    def __init__(self, function: Callable[..., Any], maxsize: int = 8, policy: str = "drop_oldest") -> None:
+        self.function: Callable[..., Any] = function
+        self.policy: str = policy
+        self.queue: queue.Queue[tuple | None] = queue.Queue(max(1, maxsize))
+        self.dropped: int = 0
+        self.closed: bool = False
+        self.lock: threading.Lock = threading.Lock()
+        self.thread: threading.Thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __call__(self, *args: Any) -> None:
+        with self.lock:
+            if not self.closed:
+                self.put(args)
+                return
+        # Nothing drains the queue after close, run in the caller instead
+        self.function(*args)
+
+    def put(self, args: tuple) -> None:
+        if self.policy == "block":
+            self.queue.put(args)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(args)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def run(self) -> None:
+        while (args := self.queue.get()) is not None:
+            try:
+                self.function(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(None)
+        self.thread.join()
+
+class ResultsEmitter:
+    def __init__(self, function: Callable[[bytes], None], batch_size: int = 1, flush_interval: float = 1.0, format: str = "ndjson") -> None:
+        self.function: Callable[[bytes], None] = function
+        self.batch_size: int = max(1, batch_size)
+        self.flush_interval: float = flush_interval
+        self.encode: Callable[[datetime, list[FaceResult]], bytes] = self.encode_binary if format == "binary" else self.encode_ndjson
+        self.records: list[bytes] = []
+        self.due: float = time.monotonic() + self.flush_interval
+
+    @staticmethod
+    def encode_ndjson(now: datetime, res: list[FaceResult]) -> bytes:
+        # Same text as json.dumps of the records, without building a dict per face
+        return "".join([
+            "{\"", str(now), "\": [",
+            ", ".join([
+                f"{{\"name\": {json.dumps(face.name)}, \"image\": {json.dumps(face.image)}, \"distance\": {face.distance!r}, \"box\": [{face.box[0]}, {face.box[1]}, {face.box[2]}, {face.box[3]}]}}"
+                for face in res
+            ]),
+            "]}\n",
+        ]).encode("latin-1")
+
+    @staticmethod
+    def encode_binary(now: datetime, res: list[FaceResult]) -> bytes:
+        records: list[bytes] = [FRAME_RECORD.pack(now.timestamp(), len(res))]
+        for face in res:
+            name: bytes = face.name.encode("utf-8")
+            image: bytes = face.image.encode("utf-8")
+            records.append(FACE_RECORD.pack(len(name), len(image), face.distance, *face.box))
+            records.append(name)
+            records.append(image)
+        return b"".join(records)
+
+    def __call__(self, now: datetime, res: list[FaceResult]) -> None:
+        if res:
+            self.records.append(self.encode(now, res))
+        if len(self.records) >= self.batch_size or (self.records and time.monotonic() >= self.due):
+            self.flush()
+
+    def flush(self) -> None:
+        self.due = time.monotonic() + self.flush_interval
+        if self.records:
+            data: bytes = b"".join(self.records)
+            self.records.clear()
+            self.function(data)
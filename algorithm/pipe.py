@@ -25,11 +25,14 @@ class FaceRecognitionPipe(pipe.Pipe):
         if self.config.frame_output: self.config.frame_output.play(manager)
         if self.config.results_output: self.config.results_output.play(manager)
         if self.config.attendance_output: self.config.attendance_output.play(manager)
+        if self.config.metrics_output: self.config.metrics_output.play(manager)
 
     def stop(self, manager: Manager, result: pipe.IO) -> None:
         if not self.playing:
             return
         self.playing = False
+        face_recognition.close_functions(self.config)
         if self.config.frame_output: self.config.frame_output.stop(manager, result)
         if self.config.results_output: self.config.results_output.stop(manager, result)
         if self.config.attendance_output: self.config.attendance_output.stop(manager, result)
+        if self.config.metrics_output: self.config.metrics_output.stop(manager, result)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+from concurrent.futures import Future
+import queue
+import threading
+import time
+from insightface.app import FaceAnalysis
+import numpy as np
+import packages.face_recognition.model as model
+from typing import Any, NamedTuple
+
+class Job(NamedTuple):
+    kind: str
+    args: tuple
+    future: Future
+
+class BatchScheduler:
+    def __init__(self, app: FaceAnalysis, max_batch: int = 8, max_latency: float = 0.01) -> None:
+        self.app: FaceAnalysis = app
+        self.max_batch: int = max(1, max_batch)
+        self.max_latency: float = max_latency
+        self.clients: int = 0
+        self.closed: bool = False
+        self.lock: threading.Lock = threading.Lock()
+        self.queue: queue.Queue[Job | None] = queue.Queue()
+        self.thread: threading.Thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def unregister(self) -> None:
+        with _schedulers_lock:
+            self.clients -= 1
+            if self.clients > 0:
+                return
+            # The last pipe stopped, a later one starts a new scheduler
+            for key in [key for key, scheduler in _schedulers.items() if scheduler is self]:
+                del _schedulers[key]
+        with self.lock:
+            self.closed = True
+            self.queue.put(None)
+
+    def submit(self, kind: str, *args: Any) -> Any:
+        future: Future = Future()
+        with self.lock:
+            if self.closed:
+                raise Exception("Batch scheduler is closed")
+            self.queue.put(Job(kind, args, future))
+        return future.result()
+
+    def detect(self, frame: np.ndarray, input_size: tuple[int, int] | None = None) -> tuple[np.ndarray, np.ndarray]:
+        return self.submit("detect", frame, input_size)
+
+    def embed(self, crops: list[np.ndarray]) -> np.ndarray:
+        if not crops:
+            return model.embed(self.app, crops)
+        return self.submit("embed", crops)
+
+    def collect(self) -> list[Job] | None:
+        job: Job | None = self.queue.get()
+        if job is None:
+            return None
+        jobs: list[Job] = [job]
+        deadline: float = time.monotonic() + self.max_latency
+        # Every client waits on one job at a time, so once all of them are in there is nothing to wait for
+        while len(jobs) < min(self.max_batch, max(1, self.clients)):
+            timeout: float = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if job is None:
+                # Only queued once every client is gone, put it back for run() to see
+                self.queue.put(None)
+                break
+            jobs.append(job)
+        return jobs
+
+    def run(self) -> None:
+        try:
+            self.serve()
+        finally:
+            with self.lock:
+                self.closed = True
+            # Jobs queued behind the sentinel, or left by a failure, would otherwise wait forever
+            while True:
+                try:
+                    job: Job | None = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job.future.set_exception(Exception("Batch scheduler is closed"))
+
+    def serve(self) -> None:
+        while (jobs := self.collect()) is not None:
+            for job in jobs:
+                if job.kind == "detect":
+                    try:
+                        job.future.set_result(model.detect(self.app, *job.args))
+                    except Exception as e:
+                        job.future.set_exception(e)
+            embeds: list[Job] = [job for job in jobs if job.kind == "embed"]
+            if not embeds:
+                continue
+            # One recognition call for the faces of every frame in the batch
+            crops: list[np.ndarray] = [crop for job in embeds for crop in job.args[0]]
+            try:
+                embeddings: np.ndarray = model.embed(self.app, crops, len(crops))
+            except Exception as e:
+                for job in embeds:
+                    job.future.set_exception(e)
+                continue
+            start: int = 0
+            for job in embeds:
+                job.future.set_result(embeddings[start:start + len(job.args[0])])
+                start += len(job.args[0])
+
+_schedulers: dict[tuple[int, int, float], BatchScheduler] = {}
+_schedulers_lock: threading.Lock = threading.Lock()
+
+def get_scheduler(app: FaceAnalysis, max_batch: int = 8, max_latency: float = 0.01) -> BatchScheduler:
+    # Models are shared per settings (see model.get_app), so pipes sharing an app and batch settings share a scheduler
+    key: tuple[int, int, float] = (id(app), max_batch, max_latency)
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = BatchScheduler(app, max_batch, max_latency)
+        _schedulers[key].clients += 1
+        return _schedulers[key]
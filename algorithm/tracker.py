@@ -0,0 +1,60 @@
+from __future__ import annotations
+import numpy as np
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from packages.face_recognition.algorithm import FaceResult
+
+def iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    top_left: np.ndarray = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right: np.ndarray = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    intersection: np.ndarray = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a: np.ndarray = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b: np.ndarray = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-6)
+
+class Track:
+    def __init__(self, box: np.ndarray) -> None:
+        self.box: np.ndarray = box
+        self.result: FaceResult | None = None
+        self.age: int = 0
+        self.misses: int = 0
+        self.iou: float = 0.0
+
+class FaceTracker:
+    def __init__(self, min_iou: float = 0.3, max_misses: int = 5) -> None:
+        self.min_iou: float = min_iou
+        self.max_misses: int = max_misses
+        self.tracks: list[Track] = []
+
+    def update(self, boxes: np.ndarray) -> list[Track]:
+        matched: list[Track | None] = [None] * len(boxes)
+        assigned: set[int] = set()
+        if self.tracks and len(boxes):
+            overlaps: np.ndarray = iou(np.stack([track.box for track in self.tracks]), boxes)
+            # Greedy association, best overlaps first
+            for flat in np.argsort(overlaps, axis=None)[::-1]:
+                track_index, box_index = divmod(int(flat), len(boxes))
+                if overlaps[track_index, box_index] < self.min_iou:
+                    break
+                if matched[box_index] is not None or track_index in assigned:
+                    continue
+                assigned.add(track_index)
+                matched[box_index] = self.tracks[track_index]
+                matched[box_index].iou = float(overlaps[track_index, box_index])
+        tracks: list[Track] = []
+        for track_index, track in enumerate(self.tracks):
+            if track_index in assigned:
+                track.misses = 0
+                track.age += 1
+                tracks.append(track)
+            elif track.misses < self.max_misses:
+                track.misses += 1
+                tracks.append(track)
+        for box_index, box in enumerate(boxes):
+            if matched[box_index] is None:
+                matched[box_index] = Track(box)
+                tracks.append(matched[box_index])
+            else:
+                matched[box_index].box = box
+        self.tracks = tracks
+        return matched
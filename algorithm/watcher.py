@@ -0,0 +1,73 @@
+from __future__ import annotations
+import os
+import threading
+import traceback
+from packages.face_recognition.data import FaceRecognitionDataConfig, FaceRecognitionDataFunction
+from packages.face_recognition.data.function import GalleryImage
+from typing import NamedTuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from packages.face_recognition.algorithm import FaceRecognitionFunction
+
+class WatchedImage(NamedTuple):
+    image: GalleryImage
+    size: int
+    mtime: int
+
+class GalleryWatcher:
+    def __init__(self, function: FaceRecognitionFunction, source: FaceRecognitionDataConfig, interval: float) -> None:
+        self.function: FaceRecognitionFunction = function
+        self.data: FaceRecognitionDataFunction = FaceRecognitionDataFunction(source)
+        self.interval: float = interval
+        self.state: dict[str, WatchedImage] = {}
+        self.stopped: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        try:
+            # Applies what changed on disk since the gallery the pipe loaded was enrolled
+            state: dict[str, WatchedImage] = self.scan()
+            loaded: set[tuple[str, str]] = self.function.gallery_keys()
+            scanned: set[tuple[str, str]] = {watched.image.name for watched in state.values()}
+            self.apply([watched for watched in state.values() if watched.image.name not in loaded], [key for key in loaded if key not in scanned])
+            self.state = state
+        except Exception:
+            traceback.print_exc()
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                traceback.print_exc()
+
+    def scan(self) -> dict[str, WatchedImage]:
+        state: dict[str, WatchedImage] = {}
+        for image in self.data.walk():
+            try:
+                stat: os.stat_result = os.stat(image.path)
+            except OSError:
+                continue
+            state[image.key] = WatchedImage(image, stat.st_size, stat.st_mtime_ns)
+        return state
+
+    def poll(self) -> None:
+        # A stat per image, only new and modified images are loaded and embedded
+        state: dict[str, WatchedImage] = self.scan()
+        changed: list[WatchedImage] = [watched for key, watched in state.items() if key not in self.state or (self.state[key].size, self.state[key].mtime) != (watched.size, watched.mtime)]
+        removed: list[tuple[str, str]] = [watched.image.name for key, watched in self.state.items() if key not in state]
+        self.apply(changed, removed)
+        self.state = state
+
+    def apply(self, changed: list[WatchedImage], removed: list[tuple[str, str]]) -> None:
+        if changed:
+            # The cache would reload every embedding to find a few, these images miss it anyway
+            names, embeddings = self.data.enroll(skip_failures=True, progress=False, images=[watched.image for watched in changed], use_cache=False)
+            enrolled: set[tuple[str, str]] = set(names)
+            # Images that now fail are dropped, like a full enrollment would
+            removed.extend(watched.image.name for watched in changed if watched.image.name not in enrolled)
+            self.function.update_gallery(names, embeddings if names else None, removed)
+        elif removed:
+            self.function.update_gallery(removed=removed)
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.thread.join()
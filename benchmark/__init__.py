@@ -0,0 +1 @@
+from packages.face_recognition.benchmark.suites import bench_enrollment, bench_index, bench_pipeline, bench_storage, environment
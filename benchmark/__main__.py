@@ -0,0 +1,62 @@
+from __future__ import annotations
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import sys
+from typing import Any, Callable
+from packages.face_recognition.benchmark import bench_enrollment, bench_index, bench_pipeline, bench_storage, environment
+
+SUITES: tuple[str, ...] = ("index", "storage", "pipeline", "enrollment")
+
+def isolated(function: Callable[..., list[dict]], *args: Any, **kwargs: Any) -> list[dict]:
+    # A fresh process per suite, so max_rss_mb is the suite's own peak and not one left over from an earlier suite
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args, **kwargs).result()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m packages.face_recognition.benchmark", description="Offline, CPU-only benchmarks for the face recognition package")
+    parser.add_argument("suites", nargs="*", default=list(SUITES), help=f"any of {', '.join(SUITES)} (default: all)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="gallery sizes for the index and storage suites")
+    parser.add_argument("--faces", type=int, default=4, help="faces per synthetic frame")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--gallery", type=int, default=10000, help="gallery size for the pipeline suite")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[1280, 720], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--images", type=int, default=500, help="images for the enrollment suite")
+    parser.add_argument("--workers", type=int, default=4, help="decode workers for the enrollment suite")
+    parser.add_argument("--real-models", action="store_true", help="use the InsightFace models instead of the stub detector/embedder (downloads them on first use)")
+    parser.add_argument("--frame", help="image with faces for the pipeline suite, required with --real-models")
+    parser.add_argument("--gallery-dir", help="database of face photos for the enrollment suite, required with --real-models")
+    parser.add_argument("--option", action="append", default=[], metavar="KEY=JSON", help="FaceRecognitionConfig field for the pipeline suite, e.g. --option tracking=true")
+    parser.add_argument("--data-option", action="append", default=[], metavar="KEY=JSON", help="FaceRecognitionDataConfig field for the enrollment suite, e.g. --data-option batch_size=64")
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args()
+    if set(args.suites) - set(SUITES):
+        parser.error(f"unknown suites {', '.join(sorted(set(args.suites) - set(SUITES)))}")
+    # Synthetic frames and galleries are noise, the real detector finds no faces in them
+    if args.real_models and "pipeline" in args.suites and not args.frame:
+        parser.error("the pipeline suite needs --frame with --real-models")
+    if args.real_models and "enrollment" in args.suites and not args.gallery_dir:
+        parser.error("the enrollment suite needs --gallery-dir with --real-models")
+
+    options: dict = {key: json.loads(value) for key, value in (option.split("=", 1) for option in args.option)}
+    data_options: dict = {key: json.loads(value) for key, value in (option.split("=", 1) for option in args.data_option)}
+    results: list[dict] = []
+    if "index" in args.suites:
+        results.extend(isolated(bench_index, args.sizes, max(args.faces, 1)))
+    if "storage" in args.suites:
+        results.extend(isolated(bench_storage, args.sizes, max(args.faces, 1)))
+    if "pipeline" in args.suites:
+        results.extend(isolated(bench_pipeline, args.gallery, args.faces, args.frames, args.resolution[1], args.resolution[0], not args.real_models, args.frame, **{"metrics": True, **options}))
+    if "enrollment" in args.suites:
+        results.extend(isolated(bench_enrollment, args.images, args.workers, not args.real_models, args.gallery_dir, **data_options))
+
+    report: str = json.dumps({"environment": environment(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+if __name__ == "__main__":
+    main()
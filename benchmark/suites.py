@@ -0,0 +1,180 @@
+from __future__ import annotations
+import gc
+import os
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import voyager
+import packages.face_recognition.model as model
+from packages.face_recognition.algorithm import FaceRecognitionConfig, FaceRecognitionFunction, FaceRecognitionInput
+from packages.face_recognition.algorithm.index import ExactIndex
+from packages.face_recognition.benchmark.synthetic import StubApp, noisy_queries, random_embeddings, random_names, synthetic_frame, write_gallery
+from packages.face_recognition.data import FaceRecognitionDataConfig, FaceRecognitionDataFunction, FaceRecognitionDataOutput
+from packages.face_recognition.data.names import NameTable
+from packages.face_recognition.data.store import STORAGE, build_index, quantize
+from typing import Any, Callable
+
+def max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and covers the whole process, so __main__ runs each suite in its own
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def timed(function: Callable[[], Any]) -> tuple[Any, float]:
+    start: float = time.perf_counter()
+    result: Any = function()
+    return result, time.perf_counter() - start
+
+def index_mb(index: ExactIndex | voyager.Index) -> float:
+    # Voyager allocates natively where tracemalloc cannot see, so its serialized size stands in
+    return (index.embeddings.nbytes if isinstance(index, ExactIndex) else len(index.as_bytes())) / 2**20
+
+def top1(index: ExactIndex | voyager.Index, queries: np.ndarray, chunk: int = 100) -> np.ndarray:
+    # In chunks, a single query of every recall query holds a distance row per query and gallery entry
+    return np.concatenate([index.query(queries[start:start + chunk], k=1)[0][:, 0] for start in range(0, len(queries), chunk)])
+
+def retained(function: Callable[[], Any]) -> tuple[Any, float]:
+    gc.collect()
+    tracemalloc.start()
+    result: Any = function()
+    gc.collect()
+    current: int = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, current / 2**20
+
+def latency(function: Callable[[], Any], repeat: int) -> dict[str, float]:
+    function()
+    samples: np.ndarray = np.empty(repeat)
+    for run in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        samples[run] = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(samples * 1000, (50, 95, 99))
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99), "mean_ms": float(samples.mean() * 1000)}
+
+def bench_index(sizes: list[int], faces: int = 30, repeat: int = 50, k: int = 1, seed: int = 0) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    for size in sizes:
+        gallery: np.ndarray = random_embeddings(size, seed)
+        queries, truth = noisy_queries(gallery, max(faces, 1000), seed=seed + 1)
+        for backend, build in (("exact", lambda: ExactIndex(gallery)), ("voyager", lambda: build_index(gallery))):
+            index, seconds = timed(build)
+            results.append({
+                "suite": "index",
+                "backend": backend,
+                "gallery": size,
+                "build_s": seconds,
+                "index_mb": index_mb(index),
+                "recall_at_1": float(np.mean(top1(index, queries) == truth)),
+                "query_1": latency(lambda: index.query(queries[:1], k=k), repeat),
+                f"query_{faces}": latency(lambda: index.query(queries[:faces], k=k), repeat),
+                "max_rss_mb": max_rss_mb(),
+            })
+    return results
+
+def bench_storage(sizes: list[int], faces: int = 30, repeat: int = 50, seed: int = 0) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    for size in sizes:
+        gallery: np.ndarray = random_embeddings(size, seed)
+        queries, truth = noisy_queries(gallery, max(faces, 1000), seed=seed + 1)
+        # Neighbours of the full precision exact search, so quantization error is measured apart from the noise
+        reference: np.ndarray = top1(ExactIndex(gallery), queries)
+        names, list_mb = retained(lambda: random_names(size))
+        _, table_mb = retained(lambda: NameTable.from_names(names))
+        for storage in STORAGE:
+            embeddings: np.ndarray = quantize(gallery, storage)
+            for backend, build in (("exact", lambda: ExactIndex(embeddings)), ("voyager", lambda: build_index(embeddings))):
+                index, seconds = timed(build)
+                neighbors: np.ndarray = top1(index, queries)
+                results.append({
+                    "suite": "storage",
+                    "storage": storage,
+                    "backend": backend,
+                    "gallery": size,
+                    "build_s": seconds,
+                    "gallery_mb": index_mb(index),
+                    "names_mb": {"list": list_mb, "table": table_mb},
+                    "recall_at_1": float(np.mean(neighbors == truth)),
+                    "agreement_at_1": float(np.mean(neighbors == reference)),
+                    f"query_{faces}": latency(lambda: index.query(queries[:faces], k=1), repeat),
+                    "max_rss_mb": max_rss_mb(),
+                })
+    return results
+
+def bench_pipeline(gallery_size: int = 10000, faces: int = 4, frames: int = 200, height: int = 720, width: int = 1280, stub: bool = True, image: str | None = None, **options: Any) -> list[dict[str, Any]]:
+    gallery: np.ndarray = random_embeddings(gallery_size)
+    config: FaceRecognitionConfig = FaceRecognitionConfig(
+        data=FaceRecognitionDataOutput(names=random_names(gallery_size), embeddings=gallery),
+        **options,
+    )
+    if stub:
+        model.register_app(StubApp(faces, gallery), config.ctx_id, config.det_size, config.det_thresh, config.providers, config.modules)
+    function: FaceRecognitionFunction = FaceRecognitionFunction(config)
+    # Stand-ins for downstream pipes so encoding and serialisation are part of the measurement
+    function.frame_output = function.results_output = function.attendance_output = lambda output: None
+    # The real detector finds nothing in noise, it needs a photo with faces
+    frame: np.ndarray | None = synthetic_frame(height, width) if image is None else cv2.imread(image)
+    if frame is None:
+        raise Exception(f"{image} could not be read")
+    function(FaceRecognitionInput(frame=frame.copy()))
+    start: float = time.perf_counter()
+    for _ in range(frames):
+        function(FaceRecognitionInput(frame=frame.copy()))
+    seconds: float = time.perf_counter() - start
+    function.close()
+    stats: dict = function.stats()
+    return [{
+        "suite": "pipeline",
+        "stub": stub,
+        "gallery": gallery_size,
+        # The stub detector finds exactly --faces faces, the real one whatever is in the image
+        "faces": faces if stub else stats.get("values", {}).get("faces_per_frame", {}).get("mean"),
+        "resolution": [frame.shape[1], frame.shape[0]],
+        "image": image,
+        "options": options,
+        "frames": frames,
+        "fps": frames / seconds,
+        "stats": stats,
+        "max_rss_mb": max_rss_mb(),
+    }]
+
+def bench_enrollment(images: int = 500, workers: int = 4, stub: bool = True, gallery_dir: str | None = None, **options: Any) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        # The real detector finds nothing in the generated noise images, it needs a gallery of photos
+        if gallery_dir is None:
+            write_gallery(directory, images)
+        config: FaceRecognitionDataConfig = FaceRecognitionDataConfig(db_path=gallery_dir or directory, cache_dir=os.path.join(directory, "cache"), workers=workers, **options)
+        images = sum(1 for _ in FaceRecognitionDataFunction(config).walk())
+        if stub:
+            model.register_app(StubApp(1), config.ctx_id, config.det_size, config.det_thresh, config.providers, config.modules)
+        # Cold run embeds everything, warm run only checks the cache
+        for run in ("cold", "warm"):
+            function: FaceRecognitionDataFunction = FaceRecognitionDataFunction(config)
+            start: float = time.perf_counter()
+            function()
+            seconds: float = time.perf_counter() - start
+            results.append({
+                "suite": "enrollment",
+                "run": run,
+                "stub": stub,
+                "images": images,
+                "gallery_dir": gallery_dir,
+                "workers": workers,
+                "options": options,
+                "images_per_s": images / seconds,
+                "max_rss_mb": max_rss_mb(),
+            })
+    return results
+
+def environment() -> dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "voyager": getattr(voyager, "__version__", "unknown"),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
@@ -0,0 +1,70 @@
+from __future__ import annotations
+import os
+import numpy as np
+from PIL import Image
+from packages.face_recognition.model import EMBEDDING_SIZE
+
+# Landmarks of a frontal face relative to its box: eyes, nose, mouth corners
+LANDMARKS: np.ndarray = np.array([[0.3, 0.35], [0.7, 0.35], [0.5, 0.55], [0.35, 0.75], [0.65, 0.75]], dtype=np.float32)
+
+def random_embeddings(count: int, seed: int = 0) -> np.ndarray:
+    embeddings: np.ndarray = np.random.default_rng(seed).standard_normal((count, EMBEDDING_SIZE), dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+def noise(rng: np.random.Generator, count: int, scale: float) -> np.ndarray:
+    # scale is the expected norm of the noise relative to a unit embedding
+    return scale / np.sqrt(EMBEDDING_SIZE) * rng.standard_normal((count, EMBEDDING_SIZE), dtype=np.float32)
+
+def noisy_queries(gallery: np.ndarray, count: int, scale: float = 0.5, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    rng: np.random.Generator = np.random.default_rng(seed)
+    truth: np.ndarray = rng.integers(0, len(gallery), count)
+    queries: np.ndarray = gallery[truth] + noise(rng, count, scale)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True), truth
+
+def random_names(count: int, images_per_name: int = 5) -> list[tuple[str, str]]:
+    return [(f"person{index // images_per_name}", f"{index % images_per_name}.jpg") for index in range(count)]
+
+def synthetic_frame(height: int = 720, width: int = 1280, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+def write_gallery(path: str, images: int, images_per_name: int = 5, size: int = 256, seed: int = 0) -> None:
+    rng: np.random.Generator = np.random.default_rng(seed)
+    for index in range(images):
+        directory: str = os.path.join(path, f"person{index // images_per_name}")
+        os.makedirs(directory, exist_ok=True)
+        Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(os.path.join(directory, f"{index % images_per_name}.jpg"))
+
+class StubDetector:
+    def __init__(self, faces: int = 4) -> None:
+        self.faces: int = faces
+
+    def detect(self, img: np.ndarray, input_size: tuple[int, int] | None = None, max_num: int = 0, metric: str = 'default') -> tuple[np.ndarray, np.ndarray]:
+        height, width = img.shape[:2]
+        columns: int = max(1, int(np.ceil(np.sqrt(self.faces))))
+        size: float = min(width, height) / (columns + 1)
+        bboxes: np.ndarray = np.empty((self.faces, 5), dtype=np.float32)
+        kpss: np.ndarray = np.empty((self.faces, 5, 2), dtype=np.float32)
+        for face in range(self.faces):
+            x: float = (face % columns) * width / columns
+            y: float = (face // columns) * height / columns
+            bboxes[face] = (x, y, x + size, y + size, 0.9)
+            kpss[face] = (x, y) + LANDMARKS * size
+        return bboxes, kpss
+
+class StubRecognizer:
+    input_size: tuple[int, int] = (112, 112)
+
+    def __init__(self, gallery: np.ndarray | None = None, scale: float = 0.5, seed: int = 0) -> None:
+        self.gallery: np.ndarray | None = gallery if gallery is not None and len(gallery) else None
+        self.scale: float = scale
+        self.rng: np.random.Generator = np.random.default_rng(seed)
+
+    def get_feat(self, imgs: list[np.ndarray]) -> np.ndarray:
+        if self.gallery is None:
+            return noise(self.rng, len(imgs), 1.0)
+        return self.gallery[self.rng.integers(0, len(self.gallery), len(imgs))] + noise(self.rng, len(imgs), self.scale)
+
+class StubApp:
+    def __init__(self, faces: int = 4, gallery: np.ndarray | None = None) -> None:
+        self.det_model: StubDetector = StubDetector(faces)
+        self.models: dict = {"detection": self.det_model, "recognition": StubRecognizer(gallery)}
@@ -0,0 +1,89 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+from typing import NamedTuple
+import numpy as np
+
+CACHE_DIR: str = ".face_recognition"
+CACHE_FILE: str = "embeddings.npz"
+
+class CacheEntry(NamedTuple):
+    size: int
+    mtime: int
+    digest: str
+    embedding: np.ndarray | None
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, path: str, fingerprint: str) -> None:
+        self.path: str = path
+        self.fingerprint: str = fingerprint
+        self.entries: dict[str, CacheEntry] = {}
+        self.by_digest: dict[str, CacheEntry] = {}
+        self.seen: dict[str, CacheEntry] = {}
+        self.dirty: bool = False
+        self.lock: threading.Lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["fingerprint"]) != self.fingerprint:
+                    return
+                paths, sizes, mtimes, digests, embeddings = data["paths"], data["sizes"], data["mtimes"], data["digests"], data["embeddings"]
+        except (OSError, KeyError, ValueError):
+            return
+        for path, size, mtime, digest, embedding in zip(paths, sizes, mtimes, digests, embeddings):
+            self.entries[str(path)] = CacheEntry(int(size), int(mtime), str(digest), embedding)
+        self.by_digest = {entry.digest: entry for entry in self.entries.values()}
+
+    def get(self, key: str, path: str) -> np.ndarray | None:
+        stat = os.stat(path)
+        entry = self.entries.get(key)
+        if entry is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime_ns:
+            with self.lock:
+                self.seen[key] = entry
+            return entry.embedding
+        # Size or mtime changed (or the file was moved), fall back to the content hash
+        digest: str = file_digest(path)
+        entry = self.by_digest.get(digest)
+        with self.lock:
+            self.dirty = True
+            self.seen[key] = CacheEntry(stat.st_size, stat.st_mtime_ns, digest, entry.embedding if entry else None)
+        return entry.embedding if entry else None
+
+    def put(self, key: str, embedding: np.ndarray) -> None:
+        with self.lock:
+            self.seen[key] = self.seen[key]._replace(embedding=embedding)
+
+    def save(self, prune: bool = True) -> None:
+        # Only a complete walk may drop entries, an aborted one keeps what it did not reach
+        entries: dict[str, CacheEntry] = {} if prune else dict(self.entries)
+        entries.update((key, entry) for key, entry in self.seen.items() if entry.embedding is not None)
+        if not self.dirty and entries.keys() == self.entries.keys():
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path: str = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                fingerprint=np.array(self.fingerprint),
+                paths=np.array(list(entries.keys()), dtype=str),
+                sizes=np.array([entry.size for entry in entries.values()], dtype=np.int64),
+                mtimes=np.array([entry.mtime for entry in entries.values()], dtype=np.int64),
+                digests=np.array([entry.digest for entry in entries.values()], dtype=str),
+                embeddings=np.stack([entry.embedding for entry in entries.values()]) if entries else np.empty((0, 512), dtype=np.float32),
+            )
+        os.replace(tmp_path, self.path)
+        self.entries = entries
+        self.by_digest = {entry.digest: entry for entry in entries.values()}
+        self.dirty = False
@@ -1,6 +1,7 @@
 from __future__ import annotations
 import flet as ft
 from src.pipe.config import Config, ConfigUI
+from packages.face_recognition.model import MODULES, PROVIDERS
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from src.manager import Manager
@@ -12,7 +13,20 @@ class FaceRecognitionDataConfig(Config):
     ctx_id: int = 0
     det_thresh: float = 0.5
     det_size: tuple[int, int] = (640, 640)
+    providers: tuple[str, ...] = PROVIDERS
+    modules: tuple[str, ...] = MODULES
     db_path: str = "./../../db"
+    cache: bool = True
+    cache_dir: str = ""
+    workers: int = 4
+    prefetch: int = 64
+    batch_size: int = 32
+    skip_failures: bool = False
+    persist_index: bool = True
+    metrics: bool = False
+    storage: str = "float32"
+    compact_names: bool = False
+    keep_embeddings: bool = True
 
 class FaceRecognitionDataConfigUI(ConfigUI):
     def __init__(self, instance: FaceRecognitionDataPipe, manager: Manager, config_page: ConfigPage, content: ft.Control | None = None) -> None:
@@ -23,6 +37,23 @@ class FaceRecognitionDataConfigUI(ConfigUI):
             ft.TextField(self.instance.config.det_size[0], label="Detection Width", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
             ft.TextField(self.instance.config.det_size[1], label="Detection Height", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
             ft.TextField(self.instance.config.det_thresh, label="Detection Threshold", border_color="grey", input_filter=ft.InputFilter(allow=True, regex_string=r"[0-9\.]", replacement_string="")),
+            ft.Switch(label="Cache Embeddings", value=self.instance.config.cache),
+            ft.TextField(self.instance.config.cache_dir, label="Cache Path (blank for <Database Path>/.face_recognition)", border_color="grey"),
+            ft.TextField(str(self.instance.config.workers), label="Decode Workers (0 to decode inline)", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.prefetch), label="Prefetched Images", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.TextField(str(self.instance.config.batch_size), label="Recognition Batch Size", border_color="grey", input_filter=ft.NumbersOnlyInputFilter()),
+            ft.Switch(label="Skip Images that Fail", value=self.instance.config.skip_failures),
+            ft.Switch(label="Save Index next to Database", value=self.instance.config.persist_index),
+            ft.Switch(label="Record Stage Latencies", value=self.instance.config.metrics),
+            ft.Dropdown(
+                self.instance.config.storage,
+                label="Embedding Storage",
+                options=[ft.dropdown.Option("float32"), ft.dropdown.Option("float16"), ft.dropdown.Option("int8")],
+                border_color="grey",
+                dense=True,
+            ),
+            ft.Switch(label="Compact Name Table", value=self.instance.config.compact_names),
+            ft.Switch(label="Keep Embeddings after Saving Index", value=self.instance.config.keep_embeddings),
         ]))
 
     def dismiss(self) -> None:
@@ -31,4 +62,15 @@ class FaceRecognitionDataConfigUI(ConfigUI):
             db_path=self.content.controls[1].value,
             det_size=(int(self.content.controls[3].value), int(self.content.controls[2].value)),
             det_thresh=float(self.content.controls[4].value),
+            cache=self.content.controls[5].value,
+            cache_dir=self.content.controls[6].value,
+            workers=int(self.content.controls[7].value),
+            prefetch=max(1, int(self.content.controls[8].value)),
+            batch_size=max(1, int(self.content.controls[9].value)),
+            skip_failures=self.content.controls[10].value,
+            persist_index=self.content.controls[11].value,
+            metrics=self.content.controls[12].value,
+            storage=self.content.controls[13].value,
+            compact_names=self.content.controls[14].value,
+            keep_embeddings=self.content.controls[15].value,
         )
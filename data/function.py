@@ -1,54 +1,178 @@
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from insightface.app import FaceAnalysis
 from PIL import Image
 from tqdm import tqdm
 import numpy as np
 import os
 from src.pipe.function import IO, Function
-from typing import TYPE_CHECKING
-if TYPE_CHECKING:
-    from packages.face_recognition.data import FaceRecognitionDataConfig
+import packages.face_recognition.model as model
+from packages.face_recognition.data.cache import CACHE_DIR, CACHE_FILE, EmbeddingCache
+from packages.face_recognition.data.names import NameTable
+from packages.face_recognition.data.store import GalleryStore, build_index, gallery_fingerprint, quantize
+from packages.face_recognition.metrics import Metrics, NullMetrics
+from packages.face_recognition.data.config import FaceRecognitionDataConfig
+from typing import Iterable, Iterator, NamedTuple
 
 class FaceRecognitionDataOutput(IO):
     name: str = "Face Recognition Data"
-    names: list[tuple[str, str]] = []
+    names: list[tuple[str, str]] | NameTable = []
     embeddings: np.ndarray = np.array([])
+    store: str = ""
+    fingerprint: str = ""
+    source: FaceRecognitionDataConfig | None = None
+
+class GalleryImage(NamedTuple):
+    key: str
+    path: str
+    name: tuple[str, str]
+
+class LoadedImage(NamedTuple):
+    image: np.ndarray | None = None
+    embedding: np.ndarray | None = None
+    error: str | None = None
 
 class FaceRecognitionDataFunction(Function):
     cls_output: type[FaceRecognitionDataOutput] = FaceRecognitionDataOutput
 
     def __init__(self, config: FaceRecognitionDataConfig) -> None:
         self.config: FaceRecognitionDataConfig = config
+        self.metrics: Metrics = Metrics() if self.config.metrics else NullMetrics()
 
-    def get_biggest_face(self, faces: list) -> int:
-        biggest: int = 0
-        max_area: float = (faces[0].bbox[2] - faces[0].bbox[0]) * (faces[0].bbox[3] - faces[0].bbox[1])
-        for count in range(1, len(faces)):
-            face = faces[count]
-            area: float = (face.bbox[2] - face.bbox[0]) * (face.bbox[3] - face.bbox[1])
-            if area > max_area:
-                max_area = area
-                biggest = count
-        return biggest
+    @property
+    def cache_dir(self) -> str:
+        return self.config.cache_dir or os.path.join(self.config.db_path, CACHE_DIR)
 
-    def __call__(self, input: IO = IO()) -> FaceRecognitionDataOutput:
-        app: FaceAnalysis = FaceAnalysis(providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
-        app.prepare(ctx_id=self.config.ctx_id, det_thresh=self.config.det_thresh, det_size=self.config.det_size)
+    @property
+    def cache_fingerprint(self) -> str:
+        return f"buffalo_l:{tuple(self.config.det_size)}:{self.config.det_thresh}"
 
-        names: list[tuple[str, str]] = []
-        embeddings: list[np.ndarray] = []
+    def get_biggest_face(self, bboxes: np.ndarray) -> int:
+        return int(np.argmax((bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])))
 
-        for dirpath, dirnames, filenames in tqdm(os.walk(self.config.db_path)):
+    def walk(self) -> Iterator[GalleryImage]:
+        cache_dir: str = os.path.abspath(self.cache_dir)
+        for dirpath, dirnames, filenames in os.walk(self.config.db_path):
+            dirnames[:] = [dirname for dirname in dirnames if os.path.abspath(os.path.join(dirpath, dirname)) != cache_dir]
             for filename in filenames:
                 if filename.endswith(".png") or filename.endswith(".jpg"):
                     img_name: str = os.path.join(dirpath, filename)
-                    faces: list = app.get(np.array(Image.open(img_name))[:, :, ::-1])
-                    if len(faces) == 0: raise Exception(f"{img_name} has 0 faces detected")
-                    embeddings.append(faces[self.get_biggest_face(faces)].normed_embedding)
-                    names.append((os.path.basename(os.path.normpath(dirpath)).replace(".", "/"), filename))
+                    yield GalleryImage(
+                        key=os.path.relpath(img_name, self.config.db_path),
+                        path=img_name,
+                        name=(os.path.basename(os.path.normpath(dirpath)).replace(".", "/"), filename),
+                    )
+
+    def load(self, image: GalleryImage, cache: EmbeddingCache | None) -> LoadedImage:
+        try:
+            with self.metrics.time("cache"):
+                embedding: np.ndarray | None = cache.get(image.key, image.path) if cache else None
+            if embedding is not None:
+                return LoadedImage(embedding=embedding)
+            with self.metrics.time("decode"):
+                return LoadedImage(image=np.ascontiguousarray(np.array(Image.open(image.path))[:, :, ::-1]))
+        except Exception as e:
+            return LoadedImage(error=f"{image.path} could not be read: {e}")
+
+    def prefetch(self, images: Iterable[GalleryImage], cache: EmbeddingCache | None, executor: ThreadPoolExecutor | None) -> Iterator[LoadedImage]:
+        if executor is None:
+            for image in images:
+                yield self.load(image, cache)
+            return
+        queue: deque[Future[LoadedImage]] = deque()
+        for image in images:
+            queue.append(executor.submit(self.load, image, cache))
+            if len(queue) >= self.config.prefetch:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+
+    def stats(self) -> dict:
+        return self.metrics.snapshot()
+
+    def enroll(self, skip_failures: bool | None = None, progress: bool = True, images: list[GalleryImage] | None = None, use_cache: bool | None = None) -> tuple[list[tuple[str, str]], np.ndarray]:
+        app: FaceAnalysis | None = None
+        cache: EmbeddingCache | None = EmbeddingCache(os.path.join(self.cache_dir, CACHE_FILE), self.cache_fingerprint) if (self.config.cache if use_cache is None else use_cache) else None
+        executor: ThreadPoolExecutor | None = ThreadPoolExecutor(self.config.workers) if self.config.workers > 0 else None
+
+        # Only a walk of the whole database may prune the cache
+        walked: bool = images is None
+        images = list(self.walk()) if images is None else images
+        embeddings: list[np.ndarray | None] = [None] * len(images)
+        errors: list[str] = []
+        pending: list[int] = []
+        crops: list[np.ndarray] = []
+
+        def flush() -> None:
+            with self.metrics.time("embed"):
+                batch: np.ndarray = model.embed(app, crops, self.config.batch_size)
+            for index, embedding in zip(pending, batch):
+                embeddings[index] = embedding
+                if cache: cache.put(images[index].key, embedding)
+            pending.clear()
+            crops.clear()
+
+        complete: bool = False
+        try:
+            with tqdm(total=len(images), disable=not progress) as bar:
+                for index, loaded in enumerate(self.prefetch(images, cache, executor)):
+                    bar.update()
+                    self.metrics.count("images")
+                    if loaded.error is not None:
+                        self.metrics.count("failures")
+                        errors.append(loaded.error)
+                        tqdm.write(loaded.error)
+                        continue
+                    if loaded.embedding is not None:
+                        self.metrics.count("cached")
+                        embeddings[index] = loaded.embedding
+                        continue
+                    if app is None:
+                        app = model.get_app(self.config.ctx_id, self.config.det_size, self.config.det_thresh, self.config.providers, self.config.modules)
+                    with self.metrics.time("detect"):
+                        bboxes, kpss = model.detect(app, loaded.image)
+                    if len(bboxes) == 0:
+                        self.metrics.count("failures")
+                        errors.append(f"{images[index].path} has 0 faces detected")
+                        tqdm.write(errors[-1])
+                        continue
+                    biggest: int = self.get_biggest_face(bboxes)
+                    pending.append(index)
+                    with self.metrics.time("align"):
+                        crops.extend(model.align(app, loaded.image, kpss[biggest:biggest + 1]))
+                    if len(crops) >= self.config.batch_size:
+                        flush()
+                flush()
+            complete = True
+        finally:
+            if executor: executor.shutdown(cancel_futures=True)
+            if cache: cache.save(prune=complete and walked)
+
+        if errors and not (self.config.skip_failures if skip_failures is None else skip_failures):
+            raise Exception("\n".join(errors))
+
+        return (
+            [image.name for image, embedding in zip(images, embeddings) if embedding is not None],
+            np.array([embedding for embedding in embeddings if embedding is not None]),
+        )
+
+    def __call__(self, input: IO = IO()) -> FaceRecognitionDataOutput:
+        names, gallery = self.enroll()
+        fingerprint: str = gallery_fingerprint(names, gallery)
+        gallery = quantize(gallery, self.config.storage)
+        if self.config.persist_index:
+            store: GalleryStore = GalleryStore(self.cache_dir)
+            if store.fingerprint() != fingerprint:
+                with self.metrics.time("index"):
+                    store.save(fingerprint, build_index(gallery))
 
         return FaceRecognitionDataOutput(
             name=self.config.name,
-            names=names,
-            embeddings=np.array(embeddings),
+            names=NameTable.from_names(names) if self.config.compact_names else names,
+            # An empty matrix keeps the dtype, recognition pipes read the vectors back from the saved index if they need them
+            embeddings=gallery if self.config.keep_embeddings or not self.config.persist_index else gallery[:0],
+            store=self.cache_dir if self.config.persist_index else "",
+            fingerprint=fingerprint,
+            source=self.config,
         )
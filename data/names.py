@@ -0,0 +1,58 @@
+from __future__ import annotations
+import numpy as np
+from typing import Iterable, Iterator
+
+class NameTable:
+    # (name, image) pairs as interned identity ids and one UTF-8 blob of image names, a few bytes per entry instead of two tuples of strings
+    def __init__(self, identities: list[str], ids: np.ndarray, images: bytes, offsets: np.ndarray) -> None:
+        self.identities: list[str] = identities
+        self.lookup: dict[str, int] = {name: id for id, name in enumerate(identities)}
+        self.ids: np.ndarray = ids
+        self.images: bytes = images
+        self.offsets: np.ndarray = offsets
+
+    @classmethod
+    def from_names(cls, names: Iterable[tuple[str, str]]) -> NameTable:
+        table: NameTable = cls([], np.empty(0, dtype=np.int32), b"", np.zeros(1, dtype=np.int64))
+        table.extend(names)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> tuple[str, str]:
+        index = int(index)
+        return self.identities[self.ids[index]], self.images[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def rows(self, name: str) -> np.ndarray:
+        if name not in self.lookup:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.ids == self.lookup[name])
+
+    def indices(self, names: Iterable[tuple[str, str]]) -> list[int]:
+        # Only the rows of the given identities are decoded
+        wanted: dict[str, set[str]] = {}
+        for name, image in names:
+            wanted.setdefault(name, set()).add(image)
+        return [int(index) for name, images in wanted.items() for index in self.rows(name) if self[index][1] in images]
+
+    def copy(self) -> NameTable:
+        return NameTable(list(self.identities), self.ids, self.images, self.offsets)
+
+    def extend(self, names: Iterable[tuple[str, str]]) -> None:
+        ids: list[int] = []
+        images: list[bytes] = []
+        for name, image in names:
+            if name not in self.lookup:
+                self.lookup[name] = len(self.identities)
+                self.identities.append(name)
+            ids.append(self.lookup[name])
+            images.append(image.encode("utf-8"))
+        # New arrays rather than in place, copies share them
+        self.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int32)])
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum([len(image) for image in images], dtype=np.int64)])
+        self.images += b"".join(images)
@@ -0,0 +1,172 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import numpy as np
+import voyager
+from packages.face_recognition.model import EMBEDDING_SIZE
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from packages.face_recognition.data import FaceRecognitionDataOutput
+
+FINGERPRINT_FILE: str = "fingerprint"
+STORAGE: dict[str, voyager.StorageDataType] = {
+    "float32": voyager.StorageDataType.Float32,
+    # Voyager has no 16-bit storage, so its index stays full precision
+    "float16": voyager.StorageDataType.Float32,
+    "int8": voyager.StorageDataType.Float8,
+}
+# Voyager's Float8 scale, every component of a unit embedding fits
+INT8_SCALE: float = 127.0
+# Rows converted at a time so a compact gallery never has a full float32 copy
+CHUNK: int = 65536
+
+def storage_of(embeddings: np.ndarray) -> str:
+    return embeddings.dtype.name if embeddings.dtype.name in STORAGE else "float32"
+
+def quantize(embeddings: np.ndarray, storage: str = "float32") -> np.ndarray:
+    embeddings = np.asarray(embeddings).reshape(-1, EMBEDDING_SIZE)
+    if embeddings.dtype.name == storage:
+        return embeddings
+    embeddings = dequantize(embeddings)
+    if storage == "int8":
+        return np.clip(np.rint(embeddings * INT8_SCALE), -INT8_SCALE, INT8_SCALE).astype(np.int8)
+    return embeddings.astype(storage)
+
+def dequantize(embeddings: np.ndarray) -> np.ndarray:
+    if embeddings.dtype == np.int8:
+        return embeddings.astype(np.float32) / INT8_SCALE
+    return embeddings.astype(np.float32, copy=False)
+
+def gallery_fingerprint(names: list[tuple[str, str]], embeddings: np.ndarray) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+    for name, image in names:
+        digest.update(f"{name}\0{image}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def build_index(embeddings: np.ndarray, space: voyager.Space = voyager.Space.Euclidean, M: int = 12, ef_construction: int = 200) -> voyager.Index:
+    if space == voyager.Space.Cosine and STORAGE[storage_of(embeddings)] == voyager.StorageDataType.Float8:
+        # Voyager normalizes and then quantizes, its stored vectors no longer match the gallery
+        raise Exception("int8 storage does not work with Cosine in Voyager, use InnerProduct, which gives the same distances for unit-length embeddings")
+    index: voyager.Index = voyager.Index(space, num_dimensions=EMBEDDING_SIZE, M=M, ef_construction=ef_construction, storage_data_type=STORAGE[storage_of(embeddings)])
+    for start in range(0, len(embeddings), CHUNK):
+        index.add_items(dequantize(embeddings[start:start + CHUNK]))
+    return index
+
+class GalleryStore:
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+
+    def index_path(self, space: voyager.Space, M: int, ef_construction: int, storage: voyager.StorageDataType = voyager.StorageDataType.Float32) -> str:
+        return os.path.join(self.path, f"index-{space.name}-{M}-{ef_construction}-{storage.name}.voy")
+
+    def fingerprint(self) -> str | None:
+        try:
+            with open(os.path.join(self.path, FINGERPRINT_FILE)) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def save(self, fingerprint: str, index: voyager.Index) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        # Invalidate first so a crash mid-write never pairs a new index with an old fingerprint
+        try:
+            os.remove(os.path.join(self.path, FINGERPRINT_FILE))
+        except FileNotFoundError:
+            pass
+        for filename in os.listdir(self.path):
+            if filename.startswith("index-") and filename.endswith(".voy"):
+                os.remove(os.path.join(self.path, filename))
+        index.save(self.index_path(index.space, index.M, index.ef_construction, index.storage_data_type))
+        with open(os.path.join(self.path, FINGERPRINT_FILE), "w") as f:
+            f.write(fingerprint)
+
+    def save_index(self, fingerprint: str, index: voyager.Index) -> None:
+        if self.fingerprint() != fingerprint:
+            return
+        tmp_path: str = self.index_path(index.space, index.M, index.ef_construction, index.storage_data_type) + ".tmp"
+        index.save(tmp_path)
+        os.replace(tmp_path, self.index_path(index.space, index.M, index.ef_construction, index.storage_data_type))
+
+    def load_index(self, fingerprint: str, space: voyager.Space, M: int, ef_construction: int, storage: voyager.StorageDataType = voyager.StorageDataType.Float32) -> voyager.Index | None:
+        path: str = self.index_path(space, M, ef_construction, storage)
+        if self.fingerprint() != fingerprint or not os.path.isfile(path):
+            return None
+        return voyager.Index.load(path)
+
+    def load_embeddings(self, fingerprint: str, storage: str = "float32") -> np.ndarray | None:
+        if self.fingerprint() != fingerprint:
+            return None
+        paths: list[str] = sorted(filename for filename in os.listdir(self.path) if filename.startswith("index-") and filename.endswith(".voy"))
+        if not paths:
+            return None
+        # Any persisted index holds every vector, prefer one stored at full precision
+        index: voyager.Index = voyager.Index.load(os.path.join(self.path, next((path for path in paths if path.endswith("-Float32.voy")), paths[0])))
+        embeddings: np.ndarray = np.empty((len(index), EMBEDDING_SIZE), dtype=storage)
+        for start in range(0, len(index), CHUNK):
+            embeddings[start:start + CHUNK] = quantize(index.get_vectors(range(start, min(start + CHUNK, len(index)))), storage)
+        return embeddings
+
+class SharedIndex:
+    # Loaded or built once by the first pipe, under its own lock so other galleries are not held up
+    def __init__(self) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.index: voyager.Index | None = None
+        self.clients: int = 0
+
+_indexes: dict[tuple[str, str, voyager.Space, int, int, voyager.StorageDataType], SharedIndex] = {}
+_indexes_lock: threading.Lock = threading.Lock()
+
+def get_embeddings(data: FaceRecognitionDataOutput) -> np.ndarray:
+    if len(data.embeddings) == len(data.names) or not data.store:
+        return data.embeddings
+    # The data pipe dropped its matrix, the persisted index still has the vectors
+    embeddings: np.ndarray | None = GalleryStore(data.store).load_embeddings(data.fingerprint, storage_of(data.embeddings))
+    if embeddings is None:
+        raise Exception(f"Embeddings of {data.name} are neither kept nor persisted, reload the data pipe")
+    return embeddings
+
+def get_index(data: FaceRecognitionDataOutput, space: voyager.Space = voyager.Space.Euclidean, M: int = 12, ef_construction: int = 200) -> voyager.Index:
+    storage: voyager.StorageDataType = STORAGE[storage_of(data.embeddings)]
+    if not data.fingerprint:
+        return build_index(data.embeddings, space, M, ef_construction)
+    key: tuple[str, str, voyager.Space, int, int, voyager.StorageDataType] = (data.store, data.fingerprint, space, M, ef_construction, storage)
+    with _indexes_lock:
+        # Drop indexes of older galleries from the same store, pipes still using them keep their own reference
+        for stale in [stale for stale in _indexes if stale[0] == data.store and stale[1] != data.fingerprint]:
+            del _indexes[stale]
+        entry: SharedIndex = _indexes.setdefault(key, SharedIndex())
+        entry.clients += 1
+    try:
+        with entry.lock:
+            if entry.index is None:
+                store: GalleryStore | None = GalleryStore(data.store) if data.store else None
+                index: voyager.Index | None = store.load_index(data.fingerprint, space, M, ef_construction, storage) if store else None
+                if index is None:
+                    index = build_index(get_embeddings(data), space, M, ef_construction)
+                    if store:
+                        try:
+                            store.save_index(data.fingerprint, index)
+                        except OSError:
+                            pass
+                entry.index = index
+            return entry.index
+    except BaseException:
+        _release(entry)
+        raise
+
+def _release(entry: SharedIndex) -> None:
+    with _indexes_lock:
+        entry.clients -= 1
+        if entry.clients > 0:
+            return
+        # The last pipe using it stopped, a later one loads it again
+        for key in [key for key, shared in _indexes.items() if shared is entry]:
+            del _indexes[key]
+
+def release_index(index: voyager.Index) -> None:
+    with _indexes_lock:
+        entry: SharedIndex | None = next((entry for entry in _indexes.values() if entry.index is index), None)
+    if entry:
+        _release(entry)
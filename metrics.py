@@ -0,0 +1,97 @@
+from __future__ import annotations
+from collections import defaultdict, deque
+import threading
+import time
+import numpy as np
+from typing import Any, Callable
+
+class Timer:
+    __slots__ = ("samples", "start")
+
+    def __init__(self, samples: deque[float]) -> None:
+        self.samples: deque[float] = samples
+        self.start: float = 0.0
+
+    def __enter__(self) -> Timer:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.samples.append(time.perf_counter() - self.start)
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> NullTimer:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+NULL_TIMER: NullTimer = NullTimer()
+
+class Metrics:
+    enabled: bool = True
+
+    def __init__(self, window: int = 1024) -> None:
+        self.timings: defaultdict[str, deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self.values: defaultdict[str, deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self.counters: defaultdict[str, int] = defaultdict(int)
+        self.gauges: dict[str, Callable[[], float]] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def time(self, stage: str) -> Timer:
+        return Timer(self.timings[stage])
+
+    def observe(self, name: str, value: float) -> None:
+        self.values[name].append(value)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name: str, function: Callable[[], float]) -> None:
+        self.gauges[name] = function
+
+    @staticmethod
+    def summary(samples: deque[float], scale: float = 1.0) -> dict[str, float]:
+        values: np.ndarray = np.array(samples.copy()) * scale
+        p50, p95, p99 = np.percentile(values, (50, 95, 99)) if len(values) else (0.0, 0.0, 0.0)
+        return {
+            "count": len(values),
+            "mean": float(values.mean()) if len(values) else 0.0,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        }
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            counters: dict[str, int] = dict(self.counters)
+        return {
+            "timings_ms": {stage: self.summary(samples, 1000) for stage, samples in list(self.timings.items())},
+            "values": {name: self.summary(samples) for name, samples in list(self.values.items())},
+            "counters": counters,
+            "gauges": {name: function() for name, function in self.gauges.items()},
+        }
+
+class NullMetrics(Metrics):
+    enabled: bool = False
+
+    def __init__(self) -> None:
+        pass
+
+    def time(self, stage: str) -> NullTimer:
+        return NULL_TIMER
+
+    def observe(self, name: str, value: float) -> None:
+        pass
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
+
+    def gauge(self, name: str, function: Callable[[], float]) -> None:
+        pass
+
+    def snapshot(self) -> dict[str, Any]:
+        return {}
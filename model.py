@@ -0,0 +1,52 @@
+from __future__ import annotations
+from insightface.app import FaceAnalysis
+from insightface.utils import face_align
+import numpy as np
+import onnxruntime
+import threading
+
+EMBEDDING_SIZE: int = 512
+PROVIDERS: tuple[str, ...] = ('CUDAExecutionProvider', 'CPUExecutionProvider')
+MODULES: tuple[str, ...] = ('detection', 'recognition')
+
+_apps: dict[tuple, FaceAnalysis] = {}
+_apps_lock: threading.Lock = threading.Lock()
+
+def app_key(ctx_id: int, det_size: tuple[int, int], det_thresh: float, providers: tuple[str, ...] = PROVIDERS, modules: tuple[str, ...] = MODULES, threads: int = 0) -> tuple:
+    # Detection and recognition are always needed, anything else is opt-in
+    return (tuple(providers), ctx_id, tuple(det_size), det_thresh, tuple(sorted(set(MODULES) | set(modules))), threads)
+
+def get_app(ctx_id: int, det_size: tuple[int, int], det_thresh: float, providers: tuple[str, ...] = PROVIDERS, modules: tuple[str, ...] = MODULES, threads: int = 0) -> FaceAnalysis:
+    key: tuple = app_key(ctx_id, det_size, det_thresh, providers, modules, threads)
+    with _apps_lock:
+        if key not in _apps:
+            # FaceAnalysis hands sess_options to every InferenceSession it creates, by default each one uses every core
+            options: onnxruntime.SessionOptions | None = None
+            if threads > 0:
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = threads
+            app: FaceAnalysis = FaceAnalysis(providers=list(providers), allowed_modules=list(key[4]), sess_options=options)
+            app.prepare(ctx_id=ctx_id, det_thresh=det_thresh, det_size=tuple(det_size))
+            _apps[key] = app
+        return _apps[key]
+
+def register_app(app: FaceAnalysis, ctx_id: int, det_size: tuple[int, int], det_thresh: float, providers: tuple[str, ...] = PROVIDERS, modules: tuple[str, ...] = MODULES, threads: int = 0) -> None:
+    with _apps_lock:
+        _apps[app_key(ctx_id, det_size, det_thresh, providers, modules, threads)] = app
+
+def detect(app: FaceAnalysis, img: np.ndarray, input_size: tuple[int, int] | None = None) -> tuple[np.ndarray, np.ndarray]:
+    bboxes, kpss = app.det_model.detect(img, input_size=input_size, max_num=0, metric='default')
+    return bboxes, kpss
+
+def align(app: FaceAnalysis, img: np.ndarray, kpss: np.ndarray) -> list[np.ndarray]:
+    image_size: int = app.models["recognition"].input_size[0]
+    return [face_align.norm_crop(img, landmark=kps, image_size=image_size) for kps in kpss]
+
+def embed(app: FaceAnalysis, crops: list[np.ndarray], batch_size: int = 32) -> np.ndarray:
+    if not crops:
+        return np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+    embeddings: np.ndarray = np.concatenate([
+        app.models["recognition"].get_feat(crops[start:start + batch_size])
+        for start in range(0, len(crops), batch_size)
+    ])
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)